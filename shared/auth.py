@@ -1,49 +1,85 @@
 """Simple cookie-based session auth for VitalForge services."""
 
 import os
-import hmac
+import asyncio
+import re
+import gzip
 import time
 import logging
-from functools import wraps
+from functools import lru_cache, wraps
 
 from fastapi import Request, Response, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import JSONResponse, RedirectResponse
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 
 logger = logging.getLogger(__name__)
 
 _SECRET = os.environ.get("VITALFORGE_SECRET", "default-dev-secret")
 _USER = os.environ.get("VITALFORGE_USER", "admin")
 _PASS = os.environ.get("VITALFORGE_PASS", "")
+_PASS_HASH = os.environ.get("VITALFORGE_PASS_HASH", "")
 _COOKIE_NAME = "vf_session"
 _MAX_AGE = 30 * 24 * 3600  # 30 days
+_MAX_COOKIE_LEN = 4096
+
+# Paths served without a session: login routes, health check, static files
+_UNAUTH_PATH = re.compile(r"^/(?:auth/|static/|health\Z)").match
 
 _serializer = URLSafeTimedSerializer(_SECRET)
+_ph = PasswordHasher(time_cost=3, memory_cost=64 * 1024, parallelism=1)
+
+# Legacy plaintext VITALFORGE_PASS: hash it once so logins verify the same way
+if not _PASS_HASH and _PASS:
+    _PASS_HASH = _ph.hash(_PASS)
+del _PASS
+
+# Sentinel distinguishing "not yet resolved" from a resolved anonymous/None user
+_MISSING = object()
 
 
 def _is_auth_configured() -> bool:
-    return bool(_PASS)
+    return bool(_PASS_HASH)
 
 
 def create_session_cookie(username: str) -> str:
     return _serializer.dumps({"user": username, "t": int(time.time())})
 
 
-def validate_session(cookie: str) -> str | None:
+@lru_cache(maxsize=1024)
+def _decode_session(cookie: str) -> tuple[str | None, int]:
+    """Verify a cookie's signature once; returns (user, issued_at)."""
     try:
         data = _serializer.loads(cookie, max_age=_MAX_AGE)
-        return data.get("user")
     except (BadSignature, SignatureExpired):
+        return None, 0
+    return data.get("user"), data.get("t", 0)
+
+
+def validate_session(cookie: str) -> str | None:
+    # Cheap rejection of obviously malformed cookies before any HMAC work
+    if not cookie or len(cookie) > _MAX_COOKIE_LEN or "." not in cookie:
+        return None
+    user, issued_at = _decode_session(cookie)
+    # Cached entries outlive the serializer's max_age check, so re-apply it
+    if user is None or time.time() - issued_at > _MAX_AGE:
         return None
+    return user
 
 
 def get_current_user(request: Request) -> str | None:
+    # Reuse the result resolved earlier in this request (e.g. by the middleware)
+    user = getattr(request.state, "user", _MISSING)
+    if user is not _MISSING:
+        return user
     if not _is_auth_configured():
-        return "anonymous"
-    cookie = request.cookies.get(_COOKIE_NAME)
-    if not cookie:
-        return None
-    return validate_session(cookie)
+        user = "anonymous"
+    else:
+        cookie = request.cookies.get(_COOKIE_NAME)
+        user = validate_session(cookie) if cookie else None
+    request.state.user = user
+    return user
 
 
 def require_auth(request: Request) -> str:
@@ -54,7 +90,14 @@ def require_auth(request: Request) -> str:
 
 
 def check_credentials(username: str, password: str) -> bool:
-    return hmac.compare_digest(username, _USER) and hmac.compare_digest(password, _PASS)
+    # The username isn't secret, so a plain comparison is enough; the password
+    # hash is always verified first so timing doesn't reveal a valid username
+    try:
+        pass_ok = _ph.verify(_PASS_HASH, password)
+    except (VerificationError, InvalidHashError):
+        pass_ok = False
+    user_ok = username == _USER
+    return pass_ok and user_ok
 
 
 LOGIN_PAGE_HTML = """<!DOCTYPE html>
@@ -136,23 +179,65 @@ LOGIN_PAGE_HTML = """<!DOCTYPE html>
 </body>
 </html>"""
 
+# Encode and compress the static login page once instead of on every request
+_LOGIN_PAGE_BYTES = LOGIN_PAGE_HTML.encode("utf-8")
+_LOGIN_PAGE_GZ = gzip.compress(_LOGIN_PAGE_BYTES)
+_LOGIN_PAGE_HEADERS = {"Cache-Control": "public, max-age=3600", "Vary": "Accept-Encoding"}
+
+
+def _login_page_response(request: Request) -> Response:
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        return Response(
+            _LOGIN_PAGE_GZ,
+            media_type="text/html; charset=utf-8",
+            headers={**_LOGIN_PAGE_HEADERS, "Content-Encoding": "gzip"},
+        )
+    return Response(_LOGIN_PAGE_BYTES, media_type="text/html; charset=utf-8", headers=_LOGIN_PAGE_HEADERS)
+
+
+class AuthMiddleware:
+    """Raw ASGI auth middleware.
+
+    Unauthenticated paths (static files, health, login) are passed straight
+    through at the ASGI layer, without building a Request or entering a
+    BaseHTTPMiddleware task.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or _UNAUTH_PATH(scope["path"]) or not _is_auth_configured():
+            await self.app(scope, receive, send)
+            return
+
+        if get_current_user(Request(scope)) is None:
+            if scope["path"].startswith("/api/"):
+                response = JSONResponse({"detail": "Not authenticated"}, status_code=401)
+            else:
+                response = RedirectResponse("/auth/login", status_code=302)
+            await response(scope, receive, send)
+            return
+
+        await self.app(scope, receive, send)
+
 
 def add_auth_routes(app):
-    """Add login/logout routes to a FastAPI app."""
-    from fastapi.responses import JSONResponse
+    """Add login/logout routes and the auth middleware to a FastAPI app."""
 
     @app.get("/auth/login")
     async def login_page(request: Request):
         if get_current_user(request):
             return RedirectResponse("/", status_code=302)
-        return HTMLResponse(LOGIN_PAGE_HTML)
+        return _login_page_response(request)
 
     @app.post("/auth/login")
     async def login(request: Request):
         body = await request.json()
         username = body.get("username", "")
         password = body.get("password", "")
-        if not check_credentials(username, password):
+        # Argon2 verification takes tens of ms; keep it off the event loop
+        if not await asyncio.to_thread(check_credentials, username, password):
             raise HTTPException(status_code=401, detail="Invalid credentials")
         cookie = create_session_cookie(username)
         response = JSONResponse({"success": True})
@@ -161,24 +246,21 @@ def add_auth_routes(app):
 
     @app.get("/auth/logout")
     async def logout():
+        _decode_session.cache_clear()
         response = RedirectResponse("/auth/login", status_code=302)
         response.delete_cookie(_COOKIE_NAME)
         return response
 
-    @app.middleware("http")
-    async def auth_middleware(request: Request, call_next):
-        # Skip auth for login routes, health check, static files, and service worker
-        path = request.url.path
-        if path.startswith("/auth/") or path == "/health" or path.startswith("/static/"):
-            return await call_next(request)
+    app.add_middleware(AuthMiddleware)
 
-        if not _is_auth_configured():
-            return await call_next(request)
 
-        user = get_current_user(request)
-        if user is None:
-            if path.startswith("/api/"):
-                raise HTTPException(status_code=401, detail="Not authenticated")
-            return RedirectResponse("/auth/login", status_code=302)
+if __name__ == "__main__":
+    import sys
+    from getpass import getpass
 
-        return await call_next(request)
+    if sys.argv[1:] != ["hash-password"]:
+        sys.exit("usage: python -m shared.auth hash-password")
+    password = getpass("Password: ")
+    if password != getpass("Confirm: "):
+        sys.exit("Passwords do not match")
+    print(_ph.hash(password))
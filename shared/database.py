@@ -1,20 +1,137 @@
+import asyncio
 import os
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 import aiosqlite
 
 DB_PATH = Path(os.getenv("DB_PATH", "/app/data/fitness.db"))
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", str(os.cpu_count() or 4)))
 
+# Dashboard metric name -> (table, value column)
+METRIC_TABLES = {
+    "sleep_duration": ("sleep", "duration_seconds"),
+    "sleep_score": ("sleep", "sleep_score"),
+    "resting_hr": ("resting_hr", "value"),
+    "hrv": ("hrv", "last_night_avg"),
+    "body_battery": ("body_battery", "highest"),
+    "body_battery_low": ("body_battery", "lowest"),
+    "stress": ("stress", "avg_level"),
+    "vo2max": ("vo2max", "vo2max_value"),
+    "weight": ("weight_history", "weight_grams"),
+    "body_fat": ("weight_history", "body_fat"),
+    "training_load": ("training_load", "acute_load"),
+    "steps": ("steps", "value"),
+    "active_calories": ("active_calories", "value"),
+}
 
-async def get_db() -> aiosqlite.Connection:
+# WAL allows many concurrent readers but only one writer, so request handlers
+# read from a pool of read-only connections while all writes funnel through a
+# single writer connection guarded by a lock.
+_read_pool: asyncio.Queue | None = None
+_writer: aiosqlite.Connection | None = None
+_writer_lock = asyncio.Lock()
+# Serializes pool creation so concurrent first callers open one set of connections
+_pools_lock = asyncio.Lock()
+
+# Applied once per connection: fewer fsyncs (NORMAL is safe under WAL), a
+# ~20 MB page cache, in-memory temp tables, and a busy timeout so concurrent
+# readers/writers wait instead of failing with SQLITE_BUSY.
+_CONNECTION_PRAGMAS = """
+    PRAGMA synchronous=NORMAL;
+    PRAGMA busy_timeout=5000;
+    PRAGMA cache_size=-20000;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA foreign_keys=ON;
+    PRAGMA mmap_size=268435456;
+"""
+
+
+async def get_db(**connect_kwargs) -> aiosqlite.Connection:
     """Open a connection to the SQLite database."""
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    db = await aiosqlite.connect(str(DB_PATH))
+    db = await aiosqlite.connect(str(DB_PATH), **connect_kwargs)
     db.row_factory = aiosqlite.Row
-    await db.execute("PRAGMA journal_mode=WAL")
+    await db.executescript("PRAGMA journal_mode=WAL;" + _CONNECTION_PRAGMAS)
+    return db
+
+
+async def _open_reader() -> aiosqlite.Connection:
+    # as_uri() percent-encodes the path, so spaces, '?' or '#' in it are safe
+    db = await aiosqlite.connect(f"{DB_PATH.resolve().as_uri()}?mode=ro", uri=True)
+    db.row_factory = aiosqlite.Row
+    await db.executescript(_CONNECTION_PRAGMAS + "PRAGMA query_only=ON;")
+    return db
+
+
+async def _open_writer() -> aiosqlite.Connection:
+    # Autocommit mode: acquire_writer() issues BEGIN IMMEDIATE / COMMIT itself
+    db = await get_db(isolation_level=None)
+    await db.execute("PRAGMA locking_mode=NORMAL")
     return db
 
 
+async def _open_pools():
+    global _read_pool, _writer
+    async with _pools_lock:
+        if _writer is None:
+            _writer = await _open_writer()
+        if _read_pool is None:
+            pool = asyncio.Queue(maxsize=POOL_SIZE)
+            for _ in range(POOL_SIZE):
+                pool.put_nowait(await _open_reader())
+            _read_pool = pool
+
+
+@asynccontextmanager
+async def acquire_reader():
+    """Borrow a pooled read-only connection for an ``async with`` block."""
+    if _read_pool is None:
+        await _open_pools()
+    try:
+        db = _read_pool.get_nowait()
+    except asyncio.QueueEmpty:
+        db = await _read_pool.get()
+    try:
+        yield db
+    finally:
+        _read_pool.put_nowait(db)
+
+
+@asynccontextmanager
+async def acquire_writer():
+    """Hold the single writer connection inside a ``BEGIN IMMEDIATE`` transaction.
+
+    The transaction commits when the block exits normally and rolls back if it
+    raises; callers should not commit themselves.
+    """
+    async with _writer_lock:
+        if _writer is None:
+            await _open_pools()
+        db = _writer
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            if db.in_transaction:
+                await db.rollback()
+            raise
+        if db.in_transaction:
+            await db.commit()
+
+
+async def close_db():
+    """Close the reader pool and writer connection (call on application shutdown)."""
+    global _read_pool, _writer
+    pool, _read_pool = _read_pool, None
+    writer, _writer = _writer, None
+    if pool is not None:
+        while not pool.empty():
+            await pool.get_nowait().close()
+    if writer is not None:
+        await writer.close()
+
+
 async def init_db():
     """Create all tables if they don't exist."""
     db = await get_db()
@@ -30,6 +147,17 @@ async def init_db():
                 synced_to_garmin INTEGER DEFAULT 0
             )
         """)
+        # Serves both the trend range scan and the recent-entries ORDER BY/LIMIT
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_weight_log_timestamp ON weight_log (timestamp)")
+        # Weigh-ins still waiting to be pushed to Garmin, with their failed
+        # attempts so far; rows leave once pushed (or with their weight_log row)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS garmin_push_queue (
+                weight_id INTEGER PRIMARY KEY REFERENCES weight_log (id) ON DELETE CASCADE,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT
+            )
+        """)
 
         # Phase 2: metric tables — one per metric type, all keyed by date
         await db.execute("""
@@ -134,6 +262,36 @@ async def init_db():
             )
         """)
 
+        # Recommendations cache, keyed by a hash of the LLM inputs
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS recommendation_cache (
+                key TEXT PRIMARY KEY,
+                ts REAL NOT NULL,
+                payload BLOB NOT NULL
+            )
+        """)
+
+        # Raw Garmin payloads per (endpoint, date), so re-syncs skip refetching
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS garmin_cache (
+                endpoint TEXT NOT NULL,
+                date TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (endpoint, date)
+            )
+        """)
+
+        # Covering (date, value) indexes let date-range chart queries be
+        # answered from the index B-tree without touching the table rows
+        for table, column in METRIC_TABLES.values():
+            await db.execute(
+                f"CREATE INDEX IF NOT EXISTS [idx_{table}_date_{column}] ON [{table}] (date, [{column}])"
+            )
+
+        await db.execute("ANALYZE")
         await db.commit()
     finally:
         await db.close()
+
+    await _open_pools()
@@ -1,15 +1,24 @@
+import asyncio
 import os
 import logging
-from datetime import datetime, timezone
+import time
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
-from garminconnect import Garmin
+import orjson
+from garminconnect import Garmin, GarminConnectAuthenticationError
+
+from shared.database import acquire_reader, acquire_writer
 
 logger = logging.getLogger(__name__)
 
 GARTH_TOKEN_DIR = Path(os.getenv("GARTH_TOKEN_DIR", "/app/data/.garth"))
+FETCH_CONCURRENCY = int(os.getenv("GARMIN_FETCH_CONCURRENCY", "8"))
+KEEPALIVE_INTERVAL_HOURS = float(os.getenv("GARMIN_KEEPALIVE_HOURS", "6"))
 
 _client: Garmin | None = None
+_auth_lock = asyncio.Lock()
+_auth_count = 0  # completed ensure_authenticated() logins
 
 
 def authenticate():
@@ -47,6 +56,22 @@ def authenticate():
     _client = client
 
 
+async def ensure_authenticated(refresh: bool = False):
+    """Authenticate in a worker thread, single-flight across callers.
+
+    Concurrent callers share one login: whoever waited on the lock while
+    another caller authenticated returns without logging in again. Without
+    refresh, an existing session is reused as-is.
+    """
+    global _auth_count
+    seen = _auth_count
+    async with _auth_lock:
+        if _auth_count != seen or (_client is not None and not refresh):
+            return
+        await asyncio.to_thread(authenticate)
+        _auth_count += 1
+
+
 def get_client() -> Garmin:
     """Return the authenticated Garmin client, authenticating if needed."""
     if _client is None:
@@ -54,6 +79,40 @@ def get_client() -> Garmin:
     return _client
 
 
+def _touch_session():
+    """Make a cheap authenticated call, then re-save the tokens.
+
+    garth refreshes an expired OAuth2 token on the way, so the request both
+    proves the session still works and keeps the saved tokens current.
+    """
+    if _client is None:
+        raise GarminConnectAuthenticationError("no Garmin session")
+    _client.get_user_profile()
+    _client.garth.dump(str(GARTH_TOKEN_DIR))
+
+
+async def keepalive():
+    """Background loop that keeps the Garmin session warm.
+
+    Every KEEPALIVE_INTERVAL_HOURS the session is exercised with a cheap
+    authenticated call; if Garmin rejects it (or there is no client yet) a
+    full re-authentication runs here, off the request path, instead of on
+    the next user-facing call.
+    """
+    while True:
+        await asyncio.sleep(KEEPALIVE_INTERVAL_HOURS * 3600)
+        try:
+            await asyncio.to_thread(_touch_session)
+        except GarminConnectAuthenticationError as e:
+            logger.info("Refreshing Garmin session (%s)", e)
+            try:
+                await ensure_authenticated(refresh=True)
+            except Exception as e:
+                logger.warning("Garmin keepalive re-authentication failed: %s", e)
+        except Exception as e:
+            logger.warning("Garmin keepalive failed: %s", e)
+
+
 # ---------------------------------------------------------------------------
 # Push methods
 # ---------------------------------------------------------------------------
@@ -115,6 +174,15 @@ def get_body_battery(date: str) -> list | None:
         return None
 
 
+def get_body_battery_range(start_date: str, end_date: str) -> list | None:
+    """Get body battery reports, one entry per day, for a date range. Dates: YYYY-MM-DD."""
+    try:
+        return get_client().get_body_battery(start_date, end_date)
+    except Exception as e:
+        logger.warning("Failed to get body battery range %s to %s: %s", start_date, end_date, e)
+        return None
+
+
 def get_stress_data(date: str) -> dict | None:
     """Get daily stress data. date: YYYY-MM-DD."""
     try:
@@ -149,3 +217,183 @@ def get_training_status(date: str) -> dict | None:
     except Exception as e:
         logger.warning("Failed to get training status for %s: %s", date, e)
         return None
+
+
+# ---------------------------------------------------------------------------
+# Async wrappers — run the blocking pulls in worker threads so network
+# latency overlaps instead of serializing
+# ---------------------------------------------------------------------------
+
+async def get_sleep_data_async(date: str) -> dict | None:
+    return await asyncio.to_thread(get_sleep_data, date)
+
+
+async def get_user_summary_async(date: str) -> dict | None:
+    return await asyncio.to_thread(get_user_summary, date)
+
+
+async def get_hrv_data_async(date: str) -> dict | None:
+    return await asyncio.to_thread(get_hrv_data, date)
+
+
+async def get_body_battery_async(date: str) -> list | None:
+    return await asyncio.to_thread(get_body_battery, date)
+
+
+async def get_body_battery_range_async(start_date: str, end_date: str) -> list | None:
+    return await asyncio.to_thread(get_body_battery_range, start_date, end_date)
+
+
+async def get_stress_data_async(date: str) -> dict | None:
+    return await asyncio.to_thread(get_stress_data, date)
+
+
+async def get_max_metrics_async(date: str) -> list | None:
+    return await asyncio.to_thread(get_max_metrics, date)
+
+
+async def get_weight_range_async(start_date: str, end_date: str) -> dict | None:
+    return await asyncio.to_thread(get_weight_range, start_date, end_date)
+
+
+async def get_training_status_async(date: str) -> dict | None:
+    return await asyncio.to_thread(get_training_status, date)
+
+
+# Per-day payloads consumed by the dashboard sync, keyed by name
+_DAILY_FETCHERS = {
+    "sleep": get_sleep_data_async,
+    "summary": get_user_summary_async,
+    "hrv": get_hrv_data_async,
+    "body_battery": get_body_battery_async,
+    "stress": get_stress_data_async,
+    "training": get_training_status_async,
+}
+
+
+# Daily payloads Garmin can also serve for a date range in one call, keyed
+# like _DAILY_FETCHERS. Each fetcher returns a list of per-day entries
+# carrying a "date" field.
+_RANGE_FETCHERS = {
+    "body_battery": get_body_battery_range_async,
+}
+
+# Longest range requested per call; Garmin rejects some longer windows
+RANGE_CHUNK_DAYS = 28
+
+
+def _is_final(date: str, fetched_at: float) -> bool:
+    """Whether a payload for date fetched at fetched_at can be reused forever.
+
+    Garmin dates are the user's local days, so this compares against the
+    local calendar (the container's TZ). Only a fetch made at least a full
+    day after the date ended counts, leaving time for late watch syncs.
+    """
+    fetched_on = datetime.fromtimestamp(fetched_at).date()
+    return fetched_on >= datetime.fromisoformat(date).date() + timedelta(days=2)
+
+
+async def _load_cached(date: str) -> dict:
+    """Return the final cached payloads for a date, keyed by endpoint."""
+    async with acquire_reader() as db:
+        async with db.execute(
+            "SELECT endpoint, payload, fetched_at FROM garmin_cache WHERE date = ?", (date,),
+        ) as cursor:
+            rows = await cursor.fetchall()
+    return {
+        row["endpoint"]: orjson.loads(row["payload"])
+        for row in rows
+        if _is_final(date, row["fetched_at"])
+    }
+
+
+async def store_cached(date: str, payloads: dict):
+    """Cache freshly fetched payloads for a date, if they are already final.
+
+    Callers should only pass payloads that produced data, so an empty
+    response (watch not synced yet) is never frozen in the cache.
+    """
+    now = time.time()
+    if not payloads or not _is_final(date, now):
+        return
+    async with acquire_writer() as db:
+        await db.executemany(
+            "INSERT OR REPLACE INTO garmin_cache (endpoint, date, payload, fetched_at) VALUES (?, ?, ?, ?)",
+            [(name, date, orjson.dumps(payload), now) for name, payload in payloads.items()],
+        )
+
+
+async def prune_cache(before: str):
+    """Drop cached payloads for dates before the given YYYY-MM-DD."""
+    async with acquire_writer() as db:
+        await db.execute("DELETE FROM garmin_cache WHERE date < ?", (before,))
+
+
+async def fetch_daily(
+    date: str,
+    semaphore: asyncio.Semaphore | None = None,
+    endpoints: set[str] | None = None,
+    prefetched: dict | None = None,
+) -> tuple[dict, set[str]]:
+    """Fetch the per-day payloads for a date concurrently.
+
+    Returns the payloads keyed like _DAILY_FETCHERS plus the names of those
+    that are fresh (fetched now or passed in via prefetched) rather than
+    read from garmin_cache; hand the useful fresh ones to store_cached().
+    endpoints limits the fetch to a subset of endpoints; the others come
+    back as None. Pass a shared semaphore to bound the number of in-flight
+    Garmin calls when fetching several dates at once.
+    """
+    async def _call(fetch):
+        if semaphore is None:
+            return await fetch(date)
+        async with semaphore:
+            return await fetch(date)
+
+    wanted = _DAILY_FETCHERS.keys() if endpoints is None else endpoints
+    cached = await _load_cached(date)
+    prefetched = prefetched or {}
+    payloads = dict.fromkeys(_DAILY_FETCHERS)
+    fresh = set()
+    for name in _DAILY_FETCHERS:
+        if name not in wanted:
+            continue
+        if name in cached:
+            payloads[name] = cached[name]
+        elif prefetched.get(name) is not None:
+            payloads[name] = prefetched[name]
+            fresh.add(name)
+
+    missing = [name for name in _DAILY_FETCHERS if name in wanted and payloads[name] is None]
+    if missing:
+        results = await asyncio.gather(*(_call(_DAILY_FETCHERS[name]) for name in missing))
+        payloads.update(zip(missing, results))
+        # Failed calls return None and are never cached
+        fresh.update(name for name, payload in zip(missing, results) if payload is not None)
+    return payloads, fresh
+
+
+async def fetch_daily_ranges(start_date: str, end_date: str) -> dict[str, dict]:
+    """Fetch the range-capable endpoints for a window.
+
+    Returns {date: {endpoint: payload}} with each payload in the single-day
+    endpoint's shape, ready to pass to fetch_daily(prefetched=...). This
+    turns N requests per range-capable endpoint into one per chunk.
+    """
+    start = datetime.fromisoformat(start_date).date()
+    end = datetime.fromisoformat(end_date).date()
+    chunks = []
+    while start <= end:
+        chunk_end = min(start + timedelta(days=RANGE_CHUNK_DAYS - 1), end)
+        chunks.append((start.isoformat(), chunk_end.isoformat()))
+        start = chunk_end + timedelta(days=1)
+
+    by_date: dict[str, dict] = {}
+    for name, fetch in _RANGE_FETCHERS.items():
+        results = await asyncio.gather(*(fetch(s, e) for s, e in chunks))
+        for day_entries in results:
+            for entry in day_entries or ():
+                if isinstance(entry, dict) and entry.get("date"):
+                    # The single-day endpoint returns a one-item list
+                    by_date.setdefault(entry["date"], {})[name] = [entry]
+    return by_date
@@ -0,0 +1,35 @@
+"""Static file serving with long-lived browser caching for versioned URLs."""
+
+import hashlib
+from functools import lru_cache
+from pathlib import Path
+from urllib.parse import parse_qs
+
+from fastapi.staticfiles import StaticFiles
+
+_IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles that marks content-versioned (``?v=...``) responses immutable.
+
+    Unversioned URLs (the service worker, icons referenced from the manifest)
+    keep the default ETag/Last-Modified revalidation.
+    """
+
+    async def get_response(self, path: str, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code == 200 and "v" in parse_qs(scope.get("query_string", b"").decode()):
+            response.headers["Cache-Control"] = _IMMUTABLE
+        return response
+
+
+def make_static_url(directory: Path, prefix: str = "/static"):
+    """Return a template helper mapping a file name to a content-hashed URL."""
+
+    @lru_cache(maxsize=None)
+    def static_url(name: str) -> str:
+        digest = hashlib.md5((directory / name).read_bytes()).hexdigest()[:10]
+        return f"{prefix}/{name}?v={digest}"
+
+    return static_url
@@ -1,10 +1,13 @@
 import asyncio
+import hashlib
 import sys
+import time
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException, Query
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import ORJSONResponse, Response
 from fastapi.templating import Jinja2Templates
 from fastapi.requests import Request
 
@@ -12,9 +15,11 @@ from fastapi.requests import Request
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 sys.path.insert(0, str(Path(__file__).resolve().parent))
 
-from shared.database import get_db, init_db
-from shared.garmin_client import authenticate
+from shared.database import METRIC_TABLES, acquire_reader, close_db, init_db
+from shared.garmin_client import ensure_authenticated, keepalive
 from shared.auth import add_auth_routes
+from shared.static_files import CachedStaticFiles, make_static_url
+import sync
 from sync import run_sync, scheduled_sync
 from recommendations import get_recommendations, get_rules_only
 
@@ -27,46 +32,71 @@ logger = logging.getLogger(__name__)
 # Track whether a sync is currently running
 _sync_lock = asyncio.Lock()
 
-METRIC_TABLES = {
-    "sleep_duration": ("sleep", "duration_seconds"),
-    "sleep_score": ("sleep", "sleep_score"),
-    "resting_hr": ("resting_hr", "value"),
-    "hrv": ("hrv", "last_night_avg"),
-    "body_battery": ("body_battery", "highest"),
-    "body_battery_low": ("body_battery", "lowest"),
-    "stress": ("stress", "avg_level"),
-    "vo2max": ("vo2max", "vo2max_value"),
-    "weight": ("weight_history", "weight_grams"),
-    "body_fat": ("weight_history", "body_fat"),
-    "training_load": ("training_load", "acute_load"),
-    "steps": ("steps", "value"),
-    "active_calories": ("active_calories", "value"),
+# Metric responses keyed by (metric_name, days) -> (cached_at, response),
+# oldest first. Entries expire after METRICS_CACHE_TTL seconds, the whole
+# cache is dropped once a sync completes, and at most METRICS_CACHE_MAX
+# entries are kept (days is a client parameter, bounded to 1-365 below).
+METRICS_CACHE_TTL = 300
+METRICS_CACHE_MAX = 128
+_metrics_cache: dict[tuple[str, int], tuple[float, dict]] = {}
+_metrics_cache_sync = 0.0  # sync.last_completed the cache was built after
+
+# One fixed SQL string per metric so the pooled connections' statement caches
+# can reuse the compiled plan. SQLite computes the trailing 7-point window
+# average over non-null values.
+_METRIC_SQL = {
+    name: (
+        f"SELECT date, [{column}] AS value, "
+        f"ROUND(AVG([{column}]) OVER (ORDER BY date ROWS BETWEEN 6 PRECEDING AND CURRENT ROW), 2) AS moving_avg_7d "
+        f"FROM [{table}] WHERE [{column}] IS NOT NULL AND date >= ? ORDER BY date ASC"
+    )
+    for name, (table, column) in METRIC_TABLES.items()
 }
 
 
+# Running background tasks (scheduler, keepalive, manual syncs), cancelled and
+# awaited on shutdown
+_background_tasks: set[asyncio.Task] = set()
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Initializing database...")
     await init_db()
     logger.info("Authenticating with Garmin Connect...")
     try:
-        authenticate()
+        await ensure_authenticated()
     except Exception as e:
         logger.warning("Garmin authentication failed (will retry on first sync): %s", e)
 
     # Start background sync scheduler
-    sync_task = asyncio.create_task(scheduled_sync())
+    _background_tasks.add(asyncio.create_task(scheduled_sync()))
+    _background_tasks.add(asyncio.create_task(keepalive()))
     yield
-    sync_task.cancel()
+    # Let cancelled tasks unwind out of acquire_reader/acquire_writer before
+    # the connections they hold are closed
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    await close_db()
 
 
-app = FastAPI(title="VitalForge Dashboard", lifespan=lifespan)
+app = FastAPI(title="VitalForge Dashboard", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Auth routes and middleware (must be added before other routes)
 add_auth_routes(app)
 
-app.mount("/static", StaticFiles(directory=Path(__file__).parent / "static"), name="static")
+STATIC_DIR = Path(__file__).parent / "static"
+app.mount("/static", CachedStaticFiles(directory=STATIC_DIR), name="static")
 templates = Jinja2Templates(directory=Path(__file__).parent / "templates")
+templates.env.globals["static_url"] = make_static_url(STATIC_DIR)
+
+# Page settings come from the environment, which is fixed for the process
+_INDEX_CONTEXT = {
+    "weight_url": os.environ.get("WEIGHT_URL", ""),
+    "default_unit": os.environ.get("DEFAULT_UNIT", "lbs"),
+    "tz": os.environ.get("TZ", ""),
+}
 
 
 @app.get("/health")
@@ -76,12 +106,7 @@ async def health():
 
 @app.get("/")
 async def index(request: Request):
-    return templates.TemplateResponse("index.html", {
-        "request": request,
-        "weight_url": os.environ.get("WEIGHT_URL", ""),
-        "default_unit": os.environ.get("DEFAULT_UNIT", "lbs"),
-        "tz": os.environ.get("TZ", ""),
-    })
+    return templates.TemplateResponse("index.html", {"request": request, **_INDEX_CONTEXT})
 
 
 @app.post("/api/sync")
@@ -94,70 +119,112 @@ async def trigger_sync(days: int = Query(default=7, ge=1, le=90)):
         async with _sync_lock:
             await run_sync(days=days)
 
-    asyncio.create_task(_do_sync())
+    task = asyncio.create_task(_do_sync())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
     return {"status": "started", "days": days}
 
 
+async def _load_sync_status() -> dict:
+    """Return the mirrored sync_status row, reading it from disk only once."""
+    if sync.last_status is None:
+        async with acquire_reader() as db:
+            async with db.execute("SELECT last_sync_time, last_sync_result, last_sync_days FROM sync_status WHERE id = 1") as cursor:
+                row = await cursor.fetchone()
+        if sync.last_status is None:
+            if row:
+                sync.last_status = {
+                    "last_sync_time": row["last_sync_time"],
+                    "last_sync_result": row["last_sync_result"],
+                    "last_sync_days": row["last_sync_days"],
+                }
+            else:
+                sync.last_status = {"last_sync_time": None, "last_sync_result": "never"}
+    return sync.last_status
+
+
 @app.get("/api/sync/status")
-async def sync_status():
+async def sync_status(request: Request):
     """Return last sync time and result."""
-    db = await get_db()
-    try:
-        cursor = await db.execute("SELECT last_sync_time, last_sync_result, last_sync_days FROM sync_status WHERE id = 1")
-        row = await cursor.fetchone()
-    finally:
-        await db.close()
-
-    if not row:
-        return {"last_sync_time": None, "last_sync_result": "never", "syncing": _sync_lock.locked()}
-
-    return {
-        "last_sync_time": row["last_sync_time"],
-        "last_sync_result": row["last_sync_result"],
-        "last_sync_days": row["last_sync_days"],
-        "syncing": _sync_lock.locked(),
-    }
+    status = dict(await _load_sync_status(), syncing=_sync_lock.locked())
+    body = ORJSONResponse(status).body
+    etag = f'"{hashlib.md5(body).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
 
 
-@app.get("/api/metrics/{metric_name}")
-async def get_metrics(metric_name: str, days: int = Query(default=30, ge=1, le=365)):
-    """Return time series data for a metric with 7-day moving average."""
+def _check_metric_name(metric_name: str):
     if metric_name not in METRIC_TABLES:
         raise HTTPException(
             status_code=400,
             detail=f"Unknown metric '{metric_name}'. Valid: {', '.join(sorted(METRIC_TABLES))}",
         )
 
-    table, column = METRIC_TABLES[metric_name]
 
-    db = await get_db()
-    try:
-        cursor = await db.execute(
-            f"SELECT date, [{column}] as value FROM [{table}] WHERE date >= date('now', ?) ORDER BY date ASC",
-            (f"-{days} days",),
-        )
-        rows = await cursor.fetchall()
-    finally:
-        await db.close()
+async def _load_metric(db, metric_name: str, days: int) -> dict:
+    """Return one metric's series, serving from the cache when still fresh."""
+    global _metrics_cache_sync
+    if sync.last_completed != _metrics_cache_sync:
+        _metrics_cache.clear()
+        _metrics_cache_sync = sync.last_completed
 
-    data = [{"date": row["date"], "value": row["value"]} for row in rows if row["value"] is not None]
+    key = (metric_name, days)
+    now = time.monotonic()
+    cached = _metrics_cache.get(key)
+    if cached and now - cached[0] < METRICS_CACHE_TTL:
+        return cached[1]
 
-    # Compute 7-day moving average
-    values = [d["value"] for d in data]
-    moving_avg = []
-    for i in range(len(values)):
-        window = values[max(0, i - 6):i + 1]
-        moving_avg.append(round(sum(window) / len(window), 2) if window else None)
+    # Bind a precomputed UTC cutoff (matching SQLite's date('now')) so the
+    # predicate is a plain range on the date index
+    cutoff = (datetime.now(timezone.utc).date() - timedelta(days=days)).isoformat()
+    async with db.execute(_METRIC_SQL[metric_name], (cutoff,)) as cursor:
+        rows = await cursor.fetchall()
 
-    for i, d in enumerate(data):
-        d["moving_avg_7d"] = moving_avg[i]
+    data = [{"date": row["date"], "value": row["value"], "moving_avg_7d": row["moving_avg_7d"]} for row in rows]
 
-    return {
+    result = {
         "metric": metric_name,
         "days": days,
         "count": len(data),
         "data": data,
     }
+    if sync.last_completed != _metrics_cache_sync:
+        return result  # a sync finished mid-query; don't cache pre-sync data
+    _metrics_cache.pop(key, None)
+    # Insertion order is age order, so expired entries are at the front
+    while _metrics_cache:
+        oldest = next(iter(_metrics_cache))
+        if now - _metrics_cache[oldest][0] < METRICS_CACHE_TTL and len(_metrics_cache) < METRICS_CACHE_MAX:
+            break
+        del _metrics_cache[oldest]
+    _metrics_cache[key] = (now, result)
+    return result
+
+
+@app.get("/api/metrics")
+async def get_metrics_batch(
+    metric: list[str] = Query(...),
+    days: int = Query(default=30, ge=1, le=365),
+):
+    """Return several metric series in one round-trip, keyed by metric name."""
+    names = list(dict.fromkeys(metric))
+    for name in names:
+        _check_metric_name(name)
+
+    async with acquire_reader() as db:
+        results = await asyncio.gather(*(_load_metric(db, name, days) for name in names))
+
+    return dict(zip(names, results))
+
+
+@app.get("/api/metrics/{metric_name}")
+async def get_metrics(metric_name: str, days: int = Query(default=30, ge=1, le=365)):
+    """Return time series data for a metric with 7-day moving average."""
+    _check_metric_name(metric_name)
+    async with acquire_reader() as db:
+        return await _load_metric(db, metric_name, days)
 
 
 @app.get("/api/recommendations")
@@ -1,58 +1,125 @@
 """Hybrid rules + LLM recommendations engine for VitalForge."""
 
+import asyncio
 import hashlib
-import json
 import logging
+import operator
 import os
 import sys
 import time
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone
+from functools import partial
+from itertools import takewhile
 from pathlib import Path
+from typing import NamedTuple
+
+import orjson
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
-from shared.database import get_db
+from shared.database import METRIC_TABLES, acquire_reader, acquire_writer
+
+try:
+    import anthropic
+except ImportError:  # optional: without it recommendations fall back to rules-only
+    anthropic = None
 
 logger = logging.getLogger(__name__)
 
-# Cache: { "hash": ..., "timestamp": ..., "recommendations": [...] }
-_cache = {"hash": None, "timestamp": 0, "recommendations": None}
+# Recommendations are cached in the recommendation_cache table, keyed by a
+# hash of the findings + metric summary, so they survive restarts
 CACHE_TTL = 6 * 3600  # 6 hours
+_refresh_lock = asyncio.Lock()
+
+# Shared Anthropic client, see _get_llm_client()
+_llm_client = None
+
+# Metrics fed to the rules engine and LLM summary
+RULE_METRICS = [
+    "sleep_duration", "sleep_score", "resting_hr", "hrv", "body_battery",
+    "stress", "vo2max", "weight", "training_load", "steps",
+]
+
+# Metrics whose rules and summary only need window averages, not the full
+# series; SQLite aggregates these so only one row per metric comes back
+AGGREGATE_METRICS = ("steps",)
+SERIES_METRICS = [name for name in RULE_METRICS if name not in AGGREGATE_METRICS]
+
+# Every series in one round-trip: one UNION ALL branch per metric, each bound
+# to the same date cutoff
+_ALL_METRICS_SQL = " UNION ALL ".join(
+    f"SELECT '{name}' AS metric, date, [{column}] AS value FROM [{table}] "
+    f"WHERE [{column}] IS NOT NULL AND date >= ?"
+    for name, (table, column) in ((name, METRIC_TABLES[name]) for name in SERIES_METRICS)
+) + " ORDER BY metric, date"
+
+# Windows count points back from the latest (rn = 1), matching the slices
+# _series_stats takes from a series
+_AGGREGATES_SQL = " UNION ALL ".join(
+    f"SELECT '{name}' AS metric, COUNT(*) AS n, AVG(v) AS avg_all, "
+    f"AVG(CASE WHEN rn <= 30 THEN v END) AS avg30, "
+    f"AVG(CASE WHEN rn <= 7 THEN v END) AS avg7, "
+    f"AVG(CASE WHEN rn <= 3 THEN v END) AS avg3, "
+    f"AVG(CASE WHEN rn BETWEEN 8 AND 14 THEN v END) AS avg_prev7, "
+    f"MAX(CASE WHEN rn = 1 THEN v END) AS last "
+    f"FROM (SELECT [{column}] AS v, ROW_NUMBER() OVER (ORDER BY date DESC) AS rn "
+    f"FROM [{table}] WHERE [{column}] IS NOT NULL AND date >= ?)"
+    for name, (table, column) in ((name, METRIC_TABLES[name]) for name in AGGREGATE_METRICS)
+)
 
 
 # ---------------------------------------------------------------------------
 # Data fetching helpers
 # ---------------------------------------------------------------------------
 
-async def _get_metric(table: str, column: str, days: int = 30) -> list[dict]:
-    db = await get_db()
-    try:
-        cursor = await db.execute(
-            f"SELECT date, [{column}] as value FROM [{table}] WHERE date >= date('now', ?) ORDER BY date ASC",
-            (f"-{days} days",),
-        )
-        rows = await cursor.fetchall()
-    finally:
-        await db.close()
-    return [{"date": r["date"], "value": r["value"]} for r in rows if r["value"] is not None]
-
-
-async def get_all_metrics(days: int = 30) -> dict:
-    metrics = {
-        "sleep_duration": ("sleep", "duration_seconds"),
-        "sleep_score": ("sleep", "sleep_score"),
-        "resting_hr": ("resting_hr", "value"),
-        "hrv": ("hrv", "last_night_avg"),
-        "body_battery": ("body_battery", "highest"),
-        "stress": ("stress", "avg_level"),
-        "vo2max": ("vo2max", "vo2max_value"),
-        "weight": ("weight_history", "weight_grams"),
-        "training_load": ("training_load", "acute_load"),
-        "steps": ("steps", "value"),
-    }
-    result = {}
-    for name, (table, col) in metrics.items():
-        result[name] = await _get_metric(table, col, days)
-    return result
+class MetricSeries(NamedTuple):
+    """One metric's observations as parallel lists, oldest first."""
+    date: list[str]
+    value: list
+
+
+def _empty_series() -> MetricSeries:
+    return MetricSeries([], [])
+
+
+@dataclass(slots=True)
+class Metrics:
+    """Rules engine input: one field per SERIES_METRICS entry, plus the SQL
+    window aggregates (same keys as _series_stats) for AGGREGATE_METRICS."""
+    sleep_duration: MetricSeries = field(default_factory=_empty_series)
+    sleep_score: MetricSeries = field(default_factory=_empty_series)
+    resting_hr: MetricSeries = field(default_factory=_empty_series)
+    hrv: MetricSeries = field(default_factory=_empty_series)
+    body_battery: MetricSeries = field(default_factory=_empty_series)
+    stress: MetricSeries = field(default_factory=_empty_series)
+    vo2max: MetricSeries = field(default_factory=_empty_series)
+    weight: MetricSeries = field(default_factory=_empty_series)
+    training_load: MetricSeries = field(default_factory=_empty_series)
+    steps_stats: dict | None = None
+
+
+async def get_all_metrics(days: int = 30) -> Metrics:
+    cutoff = (datetime.now(timezone.utc).date() - timedelta(days=days)).isoformat()
+    async with acquire_reader() as db:
+        async with db.execute(_ALL_METRICS_SQL, (cutoff,) * len(SERIES_METRICS)) as cursor:
+            rows = await cursor.fetchall()
+        async with db.execute(_AGGREGATES_SQL, (cutoff,) * len(AGGREGATE_METRICS)) as cursor:
+            agg_rows = await cursor.fetchall()
+
+    data = Metrics()
+    for r in rows:
+        s = getattr(data, r["metric"])
+        s.date.append(r["date"])
+        s.value.append(r["value"])
+
+    aggregates = {}
+    for r in agg_rows:
+        stats = dict(r)
+        stats.update(slope14=None, slope7=None)
+        aggregates[stats.pop("metric")] = stats
+    data.steps_stats = aggregates.get("steps")
+    return data
 
 
 # ---------------------------------------------------------------------------
@@ -60,61 +127,70 @@ async def get_all_metrics(days: int = 30) -> dict:
 # ---------------------------------------------------------------------------
 
 def avg(values: list) -> float | None:
-    valid = [v for v in values if v is not None]
-    return sum(valid) / len(valid) if valid else None
+    # Series are NULL-filtered in SQL, so the membership test (a C-level scan)
+    # almost always lets sum() run over the list without a filtered copy
+    if None in values:
+        values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else None
 
 
-def recent_values(data: list[dict], n: int) -> list:
-    return [d["value"] for d in data[-n:]]
+def recent_values(values: list, n: int) -> list:
+    return values[-n:]
 
 
-def trend_slope(data: list[dict], n: int = 14) -> float | None:
+def trend_slope(values: list, n: int = 14) -> float | None:
     """Simple linear trend over last n points. Positive = increasing."""
-    pts = data[-n:]
-    if len(pts) < 3:
+    vals = values[-n:]
+    if len(vals) < 3:
         return None
-    vals = [d["value"] for d in pts]
+    # Closed-form least squares with x = 0..n-1, so Σx and Σx² need no loop
     n_pts = len(vals)
-    x_mean = (n_pts - 1) / 2
-    y_mean = sum(vals) / n_pts
-    num = sum((i - x_mean) * (v - y_mean) for i, v in enumerate(vals))
-    den = sum((i - x_mean) ** 2 for i in range(n_pts))
-    return num / den if den else None
+    sx = n_pts * (n_pts - 1) / 2
+    sxx = n_pts * (n_pts - 1) * (2 * n_pts - 1) / 6
+    sy = sum(vals)
+    sxy = sum(map(operator.mul, range(n_pts), vals))
+    return (n_pts * sxy - sx * sy) / (n_pts * sxx - sx * sx)
 
 
-def consecutive_below(data: list[dict], threshold: float, from_end: int = 7) -> int:
+def consecutive_below(values: list, threshold: float, from_end: int = 7) -> int:
     """Count consecutive days from end where value < threshold."""
-    pts = data[-from_end:]
-    count = 0
-    for d in reversed(pts):
-        if d["value"] < threshold:
-            count += 1
-        else:
-            break
-    return count
+    # gt(threshold, v) is v < threshold; takewhile + partial keeps the scan in C
+    return len(list(takewhile(partial(operator.gt, threshold), reversed(values[-from_end:]))))
 
 
-def consecutive_above(data: list[dict], threshold: float, from_end: int = 7) -> int:
-    pts = data[-from_end:]
-    count = 0
-    for d in reversed(pts):
-        if d["value"] > threshold:
-            count += 1
-        else:
-            break
-    return count
+def consecutive_above(values: list, threshold: float, from_end: int = 7) -> int:
+    return len(list(takewhile(partial(operator.lt, threshold), reversed(values[-from_end:]))))
 
 
-# ---------------------------------------------------------------------------
-# Rules Engine
-# ---------------------------------------------------------------------------
+def _series_stats(values: list) -> dict:
+    return {
+        "n": len(values),
+        "avg_all": avg(values),
+        "avg30": avg(values[-30:]),
+        "avg7": avg(values[-7:]),
+        "avg3": avg(values[-3:]),
+        "avg_prev7": avg(values[-14:-7]),
+        "slope14": trend_slope(values, 14),
+        "slope7": trend_slope(values, 7),
+        "last": values[-1] if values else None,
+    }
+
+
+def metric_stats(data: Metrics) -> dict:
+    """Aggregates used by the rules and LLM summary, computed once per series."""
+    stats = {name: _series_stats(getattr(data, name).value) for name in SERIES_METRICS}
+    stats["steps"] = data.steps_stats or _series_stats([])
+    return stats
+
 
-def run_rules(data: dict) -> list[dict]:
+def run_rules(data: Metrics, stats: dict | None = None) -> list[dict]:
     """Analyze metrics and return list of findings."""
     findings = []
+    if stats is None:
+        stats = metric_stats(data)
 
     # --- Sleep ---
-    sleep_dur = data.get("sleep_duration", [])
+    sleep_dur = data.sleep_duration.value
     if sleep_dur:
         # Duration below 7hrs for 3+ consecutive days
         consec = consecutive_below(sleep_dur, 7 * 3600)
@@ -124,11 +200,11 @@ def run_rules(data: dict) -> list[dict]:
                 "severity": "warning",
                 "rule": "sleep_low_duration",
                 "message": f"Sleep under 7 hours for {consec} consecutive nights",
-                "data": {"consecutive_days": consec, "recent_avg_hrs": round(avg(recent_values(sleep_dur, 7)) / 3600, 1) if recent_values(sleep_dur, 7) else None},
+                "data": {"consecutive_days": consec, "recent_avg_hrs": round(stats["sleep_duration"]["avg7"] / 3600, 1) if stats["sleep_duration"]["avg7"] is not None else None},
             })
 
         # Sleep trending down over 2 weeks
-        slope = trend_slope(sleep_dur, 14)
+        slope = stats["sleep_duration"]["slope14"]
         if slope is not None and slope < -120:  # losing >2min/day over 2 weeks
             findings.append({
                 "category": "sleep",
@@ -138,7 +214,7 @@ def run_rules(data: dict) -> list[dict]:
                 "data": {"trend_min_per_day": round(slope / 60, 1)},
             })
 
-    sleep_score = data.get("sleep_score", [])
+    sleep_score = data.sleep_score.value
     if sleep_score:
         consec = consecutive_below(sleep_score, 70)
         if consec >= 3:
@@ -147,15 +223,15 @@ def run_rules(data: dict) -> list[dict]:
                 "severity": "warning",
                 "rule": "sleep_low_score",
                 "message": f"Sleep score below 70 for {consec} consecutive days",
-                "data": {"consecutive_days": consec, "recent_avg": round(avg(recent_values(sleep_score, 7)))},
+                "data": {"consecutive_days": consec, "recent_avg": round(stats["sleep_score"]["avg7"])},
             })
 
     # --- Recovery ---
-    hrv_data = data.get("hrv", [])
+    hrv_data = data.hrv.value
     if hrv_data and len(hrv_data) >= 7:
-        avg_30 = avg([d["value"] for d in hrv_data])
-        avg_7 = avg(recent_values(hrv_data, 7))
-        prev_7 = avg([d["value"] for d in hrv_data[-14:-7]]) if len(hrv_data) >= 14 else None
+        avg_30 = stats["hrv"]["avg_all"]
+        avg_7 = stats["hrv"]["avg7"]
+        prev_7 = stats["hrv"]["avg_prev7"] if len(hrv_data) >= 14 else None
 
         if avg_30:
             consec = consecutive_below(hrv_data, avg_30, 10)
@@ -179,10 +255,10 @@ def run_rules(data: dict) -> list[dict]:
                     "data": {"this_week": round(avg_7), "last_week": round(prev_7), "pct_change": round(pct_change, 1)},
                 })
 
-    rhr_data = data.get("resting_hr", [])
+    rhr_data = data.resting_hr.value
     if rhr_data and len(rhr_data) >= 7:
-        avg_30 = avg([d["value"] for d in rhr_data])
-        latest = rhr_data[-1]["value"]
+        avg_30 = stats["resting_hr"]["avg_all"]
+        latest = stats["resting_hr"]["last"]
 
         if avg_30 and latest > avg_30 * 1.1:
             findings.append({
@@ -193,7 +269,7 @@ def run_rules(data: dict) -> list[dict]:
                 "data": {"current": latest, "baseline": round(avg_30)},
             })
 
-        slope = trend_slope(rhr_data, 14)
+        slope = stats["resting_hr"]["slope14"]
         if slope is not None and slope > 0.2:  # trending up
             findings.append({
                 "category": "recovery",
@@ -203,7 +279,7 @@ def run_rules(data: dict) -> list[dict]:
                 "data": {"trend_bpm_per_day": round(slope, 2)},
             })
 
-    bb_data = data.get("body_battery", [])
+    bb_data = data.body_battery.value
     if bb_data:
         consec = consecutive_below(bb_data, 80)
         if consec >= 3:
@@ -216,7 +292,7 @@ def run_rules(data: dict) -> list[dict]:
             })
 
     # --- Stress ---
-    stress_data = data.get("stress", [])
+    stress_data = data.stress.value
     if stress_data:
         consec = consecutive_above(stress_data, 50)
         if consec >= 3:
@@ -225,10 +301,10 @@ def run_rules(data: dict) -> list[dict]:
                 "severity": "warning",
                 "rule": "stress_high",
                 "message": f"Average daily stress above 50 for {consec} consecutive days",
-                "data": {"consecutive_days": consec, "recent_avg": round(avg(recent_values(stress_data, 7)))},
+                "data": {"consecutive_days": consec, "recent_avg": round(stats["stress"]["avg7"])},
             })
 
-        slope = trend_slope(stress_data, 14)
+        slope = stats["stress"]["slope14"]
         if slope is not None and slope > 0.5:
             findings.append({
                 "category": "stress",
@@ -239,12 +315,11 @@ def run_rules(data: dict) -> list[dict]:
             })
 
     # --- Body Composition ---
-    weight_data = data.get("weight", [])
+    weight_data = data.weight.value
     if weight_data:
         # No weight data in 7+ days
-        from datetime import datetime, timedelta
-        last_date = weight_data[-1]["date"]
-        days_since = (datetime.now().date() - datetime.strptime(last_date, "%Y-%m-%d").date()).days
+        last_date = data.weight.date[-1]
+        days_since = (date.today() - date.fromisoformat(last_date)).days
         if days_since >= 7:
             findings.append({
                 "category": "body_composition",
@@ -256,8 +331,8 @@ def run_rules(data: dict) -> list[dict]:
 
         if len(weight_data) >= 14:
             # Weight gain > 2lbs/week (~907g/week)
-            recent_avg = avg(recent_values(weight_data, 7))
-            prev_avg = avg([d["value"] for d in weight_data[-14:-7]])
+            recent_avg = stats["weight"]["avg7"]
+            prev_avg = stats["weight"]["avg_prev7"]
             if recent_avg and prev_avg:
                 weekly_change = recent_avg - prev_avg
                 if weekly_change > 907:
@@ -271,11 +346,11 @@ def run_rules(data: dict) -> list[dict]:
 
             # Plateau (< 0.5lb change over 3 weeks with active training)
             if len(weight_data) >= 21:
-                avg_3wk_ago = avg([d["value"] for d in weight_data[-21:-14]])
+                avg_3wk_ago = avg(weight_data[-21:-14])
                 if recent_avg and avg_3wk_ago:
                     change_3wk = abs(recent_avg - avg_3wk_ago)
-                    tl = data.get("training_load", [])
-                    has_training = len(tl) >= 7 and avg(recent_values(tl, 7)) and avg(recent_values(tl, 7)) > 0
+                    tl = data.training_load.value
+                    has_training = len(tl) >= 7 and stats["training_load"]["avg7"] and stats["training_load"]["avg7"] > 0
                     if change_3wk < 227 and has_training:  # 0.5 lbs = 227g
                         findings.append({
                             "category": "body_composition",
@@ -286,9 +361,8 @@ def run_rules(data: dict) -> list[dict]:
                         })
 
     # --- Activity ---
-    steps_data = data.get("steps", [])
-    if steps_data and len(steps_data) >= 7:
-        avg_steps = avg(recent_values(steps_data, 7))
+    if stats["steps"]["n"] >= 7:
+        avg_steps = stats["steps"]["avg7"]
         if avg_steps and avg_steps < 7000:
             findings.append({
                 "category": "activity",
@@ -298,10 +372,10 @@ def run_rules(data: dict) -> list[dict]:
                 "data": {"weekly_avg": round(avg_steps)},
             })
 
-    tl_data = data.get("training_load", [])
+    tl_data = data.training_load.value
     if tl_data and len(tl_data) >= 14:
-        avg_recent = avg(recent_values(tl_data, 7))
-        avg_prev = avg([d["value"] for d in tl_data[-14:-7]])
+        avg_recent = stats["training_load"]["avg7"]
+        avg_prev = stats["training_load"]["avg_prev7"]
         if avg_recent and avg_prev and avg_prev > 0:
             ratio = avg_recent / avg_prev
             if ratio > 1.3:
@@ -313,9 +387,9 @@ def run_rules(data: dict) -> list[dict]:
                     "data": {"this_week": round(avg_recent), "last_week": round(avg_prev), "ratio": round(ratio, 2)},
                 })
 
-    vo2_data = data.get("vo2max", [])
+    vo2_data = data.vo2max.value
     if vo2_data and len(vo2_data) >= 14:
-        slope = trend_slope(vo2_data, 14)
+        slope = stats["vo2max"]["slope14"]
         if slope is not None and slope < -0.03:
             findings.append({
                 "category": "activity",
@@ -326,10 +400,17 @@ def run_rules(data: dict) -> list[dict]:
             })
 
     # --- Correlations ---
+    sleep_st, rhr_st, hrv_st, tl_st = (
+        stats["sleep_duration"], stats["resting_hr"], stats["hrv"], stats["training_load"]
+    )
+    # Both correlation rules share the same elevated-RHR test
+    elevated_rhr = bool(rhr_data) and rhr_st["avg_all"] and rhr_st["last"] > rhr_st["avg_all"] * 1.05
+
     if sleep_dur and rhr_data and hrv_data:
-        poor_sleep = len(sleep_dur) >= 3 and avg(recent_values(sleep_dur, 3)) and avg(recent_values(sleep_dur, 3)) < 6 * 3600
-        elevated_rhr = rhr_data and avg([d["value"] for d in rhr_data]) and rhr_data[-1]["value"] > avg([d["value"] for d in rhr_data]) * 1.05
-        low_hrv = hrv_data and avg([d["value"] for d in hrv_data]) and avg(recent_values(hrv_data, 3)) and avg(recent_values(hrv_data, 3)) < avg([d["value"] for d in hrv_data]) * 0.85
+        sleep_avg3 = sleep_st["avg3"]
+        hrv_avg3, hrv_avg_all = hrv_st["avg3"], hrv_st["avg_all"]
+        poor_sleep = len(sleep_dur) >= 3 and sleep_avg3 and sleep_avg3 < 6 * 3600
+        low_hrv = hrv_avg_all and hrv_avg3 and hrv_avg3 < hrv_avg_all * 0.85
         if poor_sleep and elevated_rhr and low_hrv:
             findings.append({
                 "category": "correlation",
@@ -340,10 +421,11 @@ def run_rules(data: dict) -> list[dict]:
             })
 
     if tl_data and hrv_data and rhr_data:
-        high_load = tl_data and len(tl_data) >= 7 and avg(recent_values(tl_data, 7)) and avg([d["value"] for d in tl_data]) and avg(recent_values(tl_data, 7)) > avg([d["value"] for d in tl_data]) * 1.2
-        declining_hrv = hrv_data and trend_slope(hrv_data, 7) is not None and trend_slope(hrv_data, 7) < -0.5
-        elevated_rhr2 = rhr_data and avg([d["value"] for d in rhr_data]) and rhr_data[-1]["value"] > avg([d["value"] for d in rhr_data]) * 1.05
-        if high_load and declining_hrv and elevated_rhr2:
+        tl_avg7, tl_avg_all = tl_st["avg7"], tl_st["avg_all"]
+        hrv_slope7 = hrv_st["slope7"]
+        high_load = len(tl_data) >= 7 and tl_avg7 and tl_avg_all and tl_avg7 > tl_avg_all * 1.2
+        declining_hrv = hrv_slope7 is not None and hrv_slope7 < -0.5
+        if high_load and declining_hrv and elevated_rhr:
             findings.append({
                 "category": "correlation",
                 "severity": "alert",
@@ -359,50 +441,94 @@ def run_rules(data: dict) -> list[dict]:
 # LLM Layer
 # ---------------------------------------------------------------------------
 
-def _build_metric_summary(data: dict) -> str:
-    """Build a text summary of metrics for the LLM prompt."""
-    lines = []
-
-    def fmt_avg(vals, n, transform=None):
-        v = avg(vals[-n:]) if vals else None
-        if v is None:
-            return "N/A"
-        return str(round(transform(v), 1) if transform else round(v, 1))
-
-    sd = [d["value"] for d in data.get("sleep_duration", [])]
-    lines.append(f"Sleep duration: 7d avg {fmt_avg(sd, 7, lambda x: x/3600)}h, 30d avg {fmt_avg(sd, 30, lambda x: x/3600)}h")
-
-    ss = [d["value"] for d in data.get("sleep_score", [])]
-    lines.append(f"Sleep score: 7d avg {fmt_avg(ss, 7)}, 30d avg {fmt_avg(ss, 30)}")
-
-    rhr = [d["value"] for d in data.get("resting_hr", [])]
-    lines.append(f"Resting HR: 7d avg {fmt_avg(rhr, 7)} bpm, 30d avg {fmt_avg(rhr, 30)} bpm")
+_SUMMARY_TMPL = "\n".join([
+    "Sleep duration: 7d avg {sleep_duration7}h, 30d avg {sleep_duration30}h",
+    "Sleep score: 7d avg {sleep_score7}, 30d avg {sleep_score30}",
+    "Resting HR: 7d avg {resting_hr7} bpm, 30d avg {resting_hr30} bpm",
+    "HRV: 7d avg {hrv7} ms, 30d avg {hrv30} ms",
+    "Body Battery highest: 7d avg {body_battery7}, 30d avg {body_battery30}",
+    "Stress: 7d avg {stress7}, 30d avg {stress30}",
+    "VO2 Max: {vo2max_last}",
+    "Weight: latest {weight_last} kg, 30d avg {weight30} kg",
+    "Steps: 7d avg {steps7}, 30d avg {steps30}",
+    "Training load: 7d avg {training_load7}, 30d avg {training_load30}",
+])
 
-    hrv = [d["value"] for d in data.get("hrv", [])]
-    lines.append(f"HRV: 7d avg {fmt_avg(hrv, 7)} ms, 30d avg {fmt_avg(hrv, 30)} ms")
+# Display divisors for metrics stored in base units (seconds, grams)
+_SUMMARY_SCALE = {"sleep_duration": 3600, "weight": 1000}
 
-    bb = [d["value"] for d in data.get("body_battery", [])]
-    lines.append(f"Body Battery highest: 7d avg {fmt_avg(bb, 7)}, 30d avg {fmt_avg(bb, 30)}")
 
-    st = [d["value"] for d in data.get("stress", [])]
-    lines.append(f"Stress: 7d avg {fmt_avg(st, 7)}, 30d avg {fmt_avg(st, 30)}")
+def _fmt_stat(v: float | None, scale: int = 1) -> str:
+    return "N/A" if v is None else f"{v / scale:.1f}"
 
-    vo2 = data.get("vo2max", [])
-    lines.append(f"VO2 Max: {vo2[-1]['value'] if vo2 else 'N/A'}")
 
-    wt = [d["value"] for d in data.get("weight", [])]
-    lines.append(f"Weight: latest {round(wt[-1]/1000, 1) if wt else 'N/A'} kg, 30d avg {fmt_avg(wt, 30, lambda x: x/1000)} kg")
-
-    steps = [d["value"] for d in data.get("steps", [])]
-    lines.append(f"Steps: 7d avg {fmt_avg(steps, 7)}, 30d avg {fmt_avg(steps, 30)}")
-
-    tl = [d["value"] for d in data.get("training_load", [])]
-    lines.append(f"Training load: 7d avg {fmt_avg(tl, 7)}, 30d avg {fmt_avg(tl, 30)}")
-
-    return "\n".join(lines)
+def _build_metric_summary(data: Metrics, stats: dict | None = None) -> str:
+    """Build a text summary of metrics for the LLM prompt."""
+    if stats is None:
+        stats = metric_stats(data)
+    fields = {}
+    for name, st in stats.items():
+        scale = _SUMMARY_SCALE.get(name, 1)
+        fields[f"{name}7"] = _fmt_stat(st["avg7"], scale)
+        fields[f"{name}30"] = _fmt_stat(st["avg30"], scale)
+    vo2 = stats["vo2max"]["last"]
+    fields["vo2max_last"] = "N/A" if vo2 is None else vo2
+    fields["weight_last"] = _fmt_stat(stats["weight"]["last"], 1000)
+    return _SUMMARY_TMPL.format(**fields)
+
+
+# Structured output: forcing this tool makes the model return parsed input
+# matching the schema instead of free text that may not be valid JSON
+_EMIT_RECS_TOOL = {
+    "name": "emit_recs",
+    "description": "Emit 3-5 health and fitness recommendations, prioritized by impact.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "recommendations": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "title": {"type": "string", "description": "Short title, 5-8 words"},
+                        "text": {"type": "string", "description": "2-3 sentences, specific and actionable"},
+                        "severity": {"type": "string", "enum": ["info", "warning", "alert"]},
+                        "metrics": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": 'Metric names this relates to, e.g. ["sleep", "hrv"]',
+                        },
+                    },
+                    "required": ["title", "text", "severity", "metrics"],
+                },
+            },
+        },
+        "required": ["recommendations"],
+    },
+}
+
+
+def _get_llm_client(api_key: str | None, base_url: str | None):
+    """Return the shared async client, creating it on first use.
+
+    Reusing one client keeps its HTTP connection pool, and so the TLS session
+    to the API, alive between refreshes.
+    """
+    global _llm_client
+    if _llm_client is None:
+        client_kwargs = {}
+        if api_key:
+            client_kwargs["api_key"] = api_key
+        if base_url:
+            client_kwargs["base_url"] = base_url
+            if not api_key:
+                client_kwargs["api_key"] = "unused"  # LiteLLM proxy handles auth
+        # Async client so the multi-second LLM round-trip doesn't block the loop
+        _llm_client = anthropic.AsyncAnthropic(**client_kwargs)
+    return _llm_client
 
 
-async def get_llm_recommendations(findings: list[dict], data: dict) -> list[dict]:
+async def get_llm_recommendations(findings: list[dict], metric_summary: str) -> list[dict]:
     """Send findings to Claude API and get structured recommendations."""
     api_key = os.environ.get("ANTHROPIC_API_KEY")
     base_url = os.environ.get("ANTHROPIC_BASE_URL")  # e.g. http://localhost:4000 for LiteLLM proxy
@@ -411,9 +537,7 @@ async def get_llm_recommendations(findings: list[dict], data: dict) -> list[dict
         logger.warning("ANTHROPIC_API_KEY/ANTHROPIC_BASE_URL not set, falling back to rules-only")
         return _findings_to_recommendations(findings)
 
-    try:
-        import anthropic
-    except ImportError:
+    if anthropic is None:
         logger.warning("anthropic package not installed, falling back to rules-only")
         return _findings_to_recommendations(findings)
 
@@ -422,20 +546,13 @@ async def get_llm_recommendations(findings: list[dict], data: dict) -> list[dict
         "Provide specific, actionable recommendations based on the patterns detected. Be direct and practical. "
         "Reference specific numbers from their data. Suggest concrete changes to training, sleep habits, nutrition, or lifestyle. "
         "Keep recommendations to 3-5 items, prioritized by impact.\n\n"
-        "Respond with a JSON array of objects, each with: "
-        '"title" (short, 5-8 words), '
-        '"text" (2-3 sentences, specific and actionable), '
-        '"severity" ("info", "warning", or "alert"), '
-        '"metrics" (list of metric names this relates to, e.g. ["sleep", "hrv"]). '
-        "Return ONLY valid JSON, no markdown or explanation."
+        "Return your recommendations by calling the emit_recs tool."
     )
 
     findings_text = "\n".join(
         f"[{f['severity'].upper()}] {f['message']}" for f in findings
     ) if findings else "No significant issues detected."
 
-    metric_summary = _build_metric_summary(data)
-
     user_message = (
         f"Here are the detected patterns:\n{findings_text}\n\n"
         f"Metric summaries (last 30 days):\n{metric_summary}\n\n"
@@ -443,26 +560,25 @@ async def get_llm_recommendations(findings: list[dict], data: dict) -> list[dict
     )
 
     try:
-        client_kwargs = {}
-        if api_key:
-            client_kwargs["api_key"] = api_key
-        if base_url:
-            client_kwargs["base_url"] = base_url
-            if not api_key:
-                client_kwargs["api_key"] = "unused"  # LiteLLM proxy handles auth
-        client = anthropic.Anthropic(**client_kwargs)
-        response = client.messages.create(
+        client = _get_llm_client(api_key, base_url)
+        response = await client.messages.create(
             model="claude-sonnet-4-20250514",
             max_tokens=1024,
             system=system_prompt,
             messages=[{"role": "user", "content": user_message}],
+            tools=[_EMIT_RECS_TOOL],
+            tool_choice={"type": "tool", "name": "emit_recs"},
         )
-        text = response.content[0].text.strip()
-        # Parse JSON response
-        recs = json.loads(text)
+        for block in response.content:
+            if block.type == "tool_use":
+                recs = block.input.get("recommendations")
+                break
+        else:
+            # Models without tool use answer in text; accept a bare JSON array
+            recs = orjson.loads(response.content[0].text.strip())
         if isinstance(recs, list):
             return recs[:5]
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         logger.warning("Failed to parse LLM response as JSON")
     except Exception as e:
         logger.error("LLM recommendation call failed: %s", e)
@@ -489,29 +605,43 @@ def _findings_to_recommendations(findings: list[dict]) -> list[dict]:
 
 async def get_recommendations(force: bool = False) -> dict:
     """Get recommendations, using cache if available."""
-    global _cache
-
     data = await get_all_metrics(days=30)
+    stats = metric_stats(data)
+    findings = run_rules(data, stats)
+    metric_summary = _build_metric_summary(data, stats)
 
-    # Compute hash of current data for cache invalidation
-    data_hash = hashlib.md5(json.dumps(data, default=str).encode()).hexdigest()
+    # Key the cache on exactly what the LLM would see, so changes in the raw
+    # data that don't alter findings or the summary don't trigger a new call
+    data_hash = hashlib.blake2b(
+        orjson.dumps([findings, metric_summary], option=orjson.OPT_SORT_KEYS), digest_size=16,
+    ).hexdigest()
 
     now = time.time()
-    if not force and _cache["hash"] == data_hash and (now - _cache["timestamp"]) < CACHE_TTL and _cache["recommendations"]:
-        return {
-            "recommendations": _cache["recommendations"],
-            "cached": True,
-            "generated_at": _cache["timestamp"],
-        }
-
-    findings = run_rules(data)
-    recommendations = await get_llm_recommendations(findings, data)
-
-    _cache = {
-        "hash": data_hash,
-        "timestamp": now,
-        "recommendations": recommendations,
-    }
+    if not force:
+        cached = await _load_cached(data_hash, now)
+        if cached:
+            return {
+                "recommendations": cached[1],
+                "cached": True,
+                "generated_at": cached[0],
+            }
+
+    # Single-flight: concurrent misses wait for the first caller's LLM call
+    # rather than each making their own, then pick up its result
+    async with _refresh_lock:
+        cached = await _load_cached(data_hash, now)
+        if cached and (not force or cached[0] >= now):
+            return {
+                "recommendations": cached[1],
+                "cached": True,
+                "generated_at": cached[0],
+            }
+
+        recommendations = await get_llm_recommendations(findings, metric_summary)
+        # An empty result is never served from the cache (see _load_cached),
+        # so storing it would only cost a write transaction per request
+        if recommendations:
+            await _store_cached(data_hash, now, recommendations)
 
     return {
         "recommendations": recommendations,
@@ -520,6 +650,26 @@ async def get_recommendations(force: bool = False) -> dict:
     }
 
 
+async def _load_cached(key: str, now: float) -> tuple[float, list[dict]] | None:
+    """Return (timestamp, recommendations) for a fresh cache entry, if any."""
+    async with acquire_reader() as db:
+        async with db.execute("SELECT ts, payload FROM recommendation_cache WHERE key = ?", (key,)) as cursor:
+            row = await cursor.fetchone()
+    if row is None or now - row["ts"] >= CACHE_TTL:
+        return None
+    recommendations = orjson.loads(row["payload"])
+    return (row["ts"], recommendations) if recommendations else None
+
+
+async def _store_cached(key: str, now: float, recommendations: list[dict]):
+    async with acquire_writer() as db:
+        await db.execute("DELETE FROM recommendation_cache WHERE ts < ?", (now - CACHE_TTL,))
+        await db.execute(
+            "INSERT OR REPLACE INTO recommendation_cache (key, ts, payload) VALUES (?, ?, ?)",
+            (key, now, orjson.dumps(recommendations)),
+        )
+
+
 async def get_rules_only() -> dict:
     """Get just the rules engine output without LLM."""
     data = await get_all_metrics(days=30)
@@ -2,46 +2,151 @@ import asyncio
 import logging
 import os
 import sys
+import time
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from pathlib import Path
 
+import aiosqlite
+
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
-from shared.database import get_db
+from shared.database import acquire_reader, acquire_writer
 from shared import garmin_client
 
 logger = logging.getLogger(__name__)
 
 SYNC_INTERVAL_HOURS = int(os.getenv("SYNC_INTERVAL_HOURS", "2"))
-
-
-async def get_synced_dates(table: str) -> set[str]:
-    """Return the set of dates already stored for a given metric table."""
-    db = await get_db()
-    try:
-        cursor = await db.execute(f"SELECT date FROM [{table}]")
-        rows = await cursor.fetchall()
-        return {row["date"] for row in rows}
-    finally:
-        await db.close()
-
-
-async def upsert(table: str, date: str, **columns):
-    """Insert or replace a row in a metric table."""
-    cols = ["date"] + list(columns.keys())
+# Days covered by the startup backfill; garmin_cache is pruned beyond it
+BACKFILL_DAYS = 90
+
+# RowBatcher flush thresholds: pending rows, and seconds since the last flush
+BATCH_MAX_ROWS = 1000
+BATCH_FLUSH_SECONDS = 2.0
+
+# time.monotonic() of the most recently finished sync, used to invalidate caches
+last_completed = 0.0
+
+# In-memory mirror of the sync_status row; None until loaded or first written
+last_status: dict | None = None
+
+
+# Daily metric tables filled by sync_date(); a past date is skipped once all
+# of them have a row for it
+SYNC_TABLES = [
+    "sleep", "resting_hr", "hrv", "body_battery",
+    "stress", "vo2max", "training_load", "steps", "active_calories",
+]
+
+# garmin_client.fetch_daily() endpoint whose payload fills each table
+_TABLE_ENDPOINTS = {
+    "sleep": "sleep",
+    "resting_hr": "summary",
+    "steps": "summary",
+    "active_calories": "summary",
+    "hrv": "hrv",
+    "body_battery": "body_battery",
+    "stress": "stress",
+    "vo2max": "training",
+    "training_load": "training",
+}
+
+# Stored dates for every table in one round-trip, bounded to the sync window
+_SYNCED_DATES_SQL = " UNION ALL ".join(
+    f"SELECT '{table}' AS tbl, date FROM [{table}] WHERE date >= ?" for table in SYNC_TABLES
+)
+
+
+async def get_synced_dates(since: str) -> dict[str, set[str]]:
+    """Return, per metric table, the dates on or after since already stored."""
+    async with acquire_reader() as db:
+        async with db.execute(_SYNCED_DATES_SQL, (since,) * len(SYNC_TABLES)) as cursor:
+            rows = await cursor.fetchall()
+    existing = {table: set() for table in SYNC_TABLES}
+    for row in rows:
+        existing[row["tbl"]].add(row["date"])
+    return existing
+
+
+@lru_cache(maxsize=None)
+def _insert_sql(table: str, cols: tuple[str, ...]) -> str:
+    """INSERT OR REPLACE statement for a table and column set.
+
+    The set of (table, cols) pairs is small and fixed by the _row() call
+    sites, so each statement string is built once and reused verbatim,
+    letting the writer connection's statement cache hit across syncs.
+    """
     placeholders = ", ".join(["?"] * len(cols))
-    col_names = ", ".join(cols)
-    values = [date] + list(columns.values())
-
-    db = await get_db()
-    try:
-        await db.execute(
-            f"INSERT OR REPLACE INTO [{table}] ({col_names}) VALUES ({placeholders})",
-            values,
-        )
-        await db.commit()
-    finally:
-        await db.close()
+    return f"INSERT OR REPLACE INTO [{table}] ({', '.join(cols)}) VALUES ({placeholders})"
+
+
+def _row(table: str, date: str, **columns) -> tuple[str, str, dict]:
+    """Describe one metric row to be written by write_rows()."""
+    return table, date, columns
+
+
+async def write_rows(db: aiosqlite.Connection, rows: list[tuple[str, str, dict]]):
+    """Insert or replace metric rows on a writer connection.
+
+    Rows are grouped by table and column set so each group is written with
+    one executemany call. The caller owns the transaction (acquire_writer()).
+    """
+    grouped: dict[tuple[str, tuple[str, ...]], list[tuple]] = {}
+    for table, date, columns in rows:
+        cols = ("date",) + tuple(columns)
+        grouped.setdefault((table, cols), []).append((date, *columns.values()))
+
+    for (table, cols), values in grouped.items():
+        await db.executemany(_insert_sql(table, cols), values)
+
+
+class RowBatcher:
+    """Buffer metric rows during a sync and write them in batches.
+
+    Rows are flushed in one transaction once max_rows are pending or
+    flush_interval seconds have passed since the last flush, so a long
+    backfill lands progressively with a handful of commits instead of one
+    per date.
+    """
+
+    def __init__(self, max_rows: int = BATCH_MAX_ROWS, flush_interval: float = BATCH_FLUSH_SECONDS):
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self._rows: list[tuple[str, str, dict]] = []
+        self._last_flush = time.monotonic()
+
+    async def add(self, rows: list[tuple[str, str, dict]]):
+        """Buffer rows, flushing if a threshold is reached.
+
+        A failed intermediate flush is logged rather than raised, so it is
+        not blamed on the date being added; the rows stay buffered and the
+        final flush in run_sync() retries them, failing the sync if the
+        database is still unwritable.
+        """
+        self._rows.extend(rows)
+        if len(self._rows) >= self.max_rows or time.monotonic() - self._last_flush >= self.flush_interval:
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Batch write failed, keeping %d rows for the next flush", len(self._rows))
+
+    async def flush(self, db: aiosqlite.Connection | None = None):
+        """Write the pending rows, on db's open transaction if given.
+
+        Rows added by other tasks while the write is in flight go to a new
+        buffer; if the write fails, the taken rows are put back in front.
+        """
+        rows, self._rows = self._rows, []
+        self._last_flush = time.monotonic()
+        try:
+            if db is not None:
+                await write_rows(db, rows)
+            elif rows:
+                async with acquire_writer() as db:
+                    await write_rows(db, rows)
+        except BaseException:
+            self._rows[:0] = rows
+            raise
 
 
 def _extract_sleep_score(dto: dict, sleep: dict) -> int | None:
@@ -56,16 +161,29 @@ def _extract_sleep_score(dto: dict, sleep: dict) -> int | None:
     return dto.get("overallSleepScoreValue") or sleep.get("overallSleepScoreValue")
 
 
-async def sync_date(date_str: str):
-    """Pull all metrics from Garmin for a single date and store them."""
+async def sync_date(
+    date_str: str,
+    semaphore: asyncio.Semaphore | None = None,
+    tables: set[str] | None = None,
+    prefetched: dict | None = None,
+) -> list[tuple[str, str, dict]]:
+    """Pull metrics from Garmin for a single date and return the rows to store.
+
+    With tables, only the endpoints feeding those tables are fetched; the
+    sections for the other endpoints see no payload and are skipped.
+    prefetched holds payloads already fetched by fetch_daily_ranges().
+    """
+    endpoints = None if tables is None else {_TABLE_ENDPOINTS[t] for t in tables}
+    payloads, fresh = await garmin_client.fetch_daily(date_str, semaphore, endpoints, prefetched)
+    rows = []
 
     # --- Sleep ---
-    sleep = garmin_client.get_sleep_data(date_str)
+    sleep = payloads["sleep"]
     if sleep and isinstance(sleep, dict):
         # garminconnect wraps sleep data under dailySleepDTO
         dto = sleep.get("dailySleepDTO", sleep)
         if isinstance(dto, dict) and dto.get("sleepTimeSeconds"):
-            await upsert(
+            rows.append(_row(
                 "sleep", date_str,
                 duration_seconds=dto.get("sleepTimeSeconds"),
                 deep_seconds=dto.get("deepSleepSeconds"),
@@ -75,52 +193,57 @@ async def sync_date(date_str: str):
                 sleep_score=_extract_sleep_score(dto, sleep),
                 avg_spo2=dto.get("averageSpO2Value"),
                 avg_respiration=dto.get("averageRespirationValue"),
-            )
+            ))
 
     # --- User summary (steps, calories, RHR) ---
-    summary = garmin_client.get_user_summary(date_str)
+    summary = payloads["summary"]
     if summary and isinstance(summary, dict):
         rhr = summary.get("restingHeartRate")
         if rhr:
-            await upsert("resting_hr", date_str, value=rhr)
+            rows.append(_row("resting_hr", date_str, value=rhr))
 
         total_steps = summary.get("totalSteps")
         if total_steps is not None:
-            await upsert("steps", date_str, value=total_steps)
+            rows.append(_row("steps", date_str, value=total_steps))
 
         active_cal = summary.get("activeKilocalories")
         if active_cal is not None:
-            await upsert("active_calories", date_str, value=active_cal)
+            rows.append(_row("active_calories", date_str, value=active_cal))
 
     # --- HRV ---
-    hrv = garmin_client.get_hrv_data(date_str)
+    hrv = payloads["hrv"]
     if hrv and isinstance(hrv, dict):
         hrv_summary = hrv.get("hrvSummary", hrv)
         if isinstance(hrv_summary, dict):
             last_night = hrv_summary.get("lastNightAvg")
             if last_night:
-                await upsert(
+                rows.append(_row(
                     "hrv", date_str,
                     last_night_avg=last_night,
                     last_night_5min_high=hrv_summary.get("lastNight5MinHigh"),
                     weekly_avg=hrv_summary.get("weeklyAvg"),
                     status=hrv_summary.get("status"),
-                )
+                ))
 
     # --- Body Battery ---
-    bb = garmin_client.get_body_battery(date_str)
+    bb = payloads["body_battery"]
     if bb:
         entry = bb[0] if isinstance(bb, list) and bb else bb
         if isinstance(entry, dict):
             # New format: compute highest/lowest from bodyBatteryValuesArray
-            bb_array = entry.get("bodyBatteryValuesArray", [])
+            # Single pass tracking the extremes, without an intermediate list
             highest = None
             lowest = None
-            if bb_array:
-                bb_levels = [item[1] for item in bb_array if isinstance(item, (list, tuple)) and len(item) >= 2 and item[1] is not None]
-                if bb_levels:
-                    highest = max(bb_levels)
-                    lowest = min(bb_levels)
+            for item in entry.get("bodyBatteryValuesArray") or ():
+                if not isinstance(item, (list, tuple)) or len(item) < 2:
+                    continue
+                level = item[1]
+                if level is None:
+                    continue
+                if highest is None or level > highest:
+                    highest = level
+                if lowest is None or level < lowest:
+                    lowest = level
 
             # Fall back to legacy keys if present
             if highest is None:
@@ -129,21 +252,21 @@ async def sync_date(date_str: str):
                 lowest = entry.get("bodyBatteryLowestValue")
 
             if highest is not None:
-                await upsert(
+                rows.append(_row(
                     "body_battery", date_str,
                     charged=entry.get("charged") or entry.get("bodyBatteryChargedValue"),
                     drained=entry.get("drained") or entry.get("bodyBatteryDrainedValue"),
                     highest=highest,
                     lowest=lowest,
-                )
+                ))
 
     # --- Stress ---
-    stress = garmin_client.get_stress_data(date_str)
+    stress = payloads["stress"]
     if stress and isinstance(stress, dict):
         # garminconnect uses avgStressLevel / overallStressLevel
         avg_stress = stress.get("avgStressLevel") or stress.get("overallStressLevel")
         if avg_stress is not None:
-            await upsert(
+            rows.append(_row(
                 "stress", date_str,
                 avg_level=avg_stress,
                 max_level=stress.get("maxStressLevel"),
@@ -151,10 +274,10 @@ async def sync_date(date_str: str):
                 low_duration=stress.get("lowStressDuration"),
                 medium_duration=stress.get("mediumStressDuration"),
                 high_duration=stress.get("highStressDuration"),
-            )
+            ))
 
     # --- VO2 Max (from training status, since get_max_metrics often returns null) ---
-    training = garmin_client.get_training_status(date_str)
+    training = payloads["training"]
     if training and isinstance(training, dict):
         # Extract VO2 Max from training status
         most_recent = training.get("mostRecentVO2Max", {})
@@ -163,11 +286,11 @@ async def sync_date(date_str: str):
             if isinstance(generic, dict):
                 vo2 = generic.get("vo2MaxValue")
                 if vo2:
-                    await upsert(
+                    rows.append(_row(
                         "vo2max", date_str,
                         vo2max_value=vo2,
                         fitness_age=generic.get("fitnessAge"),
-                    )
+                    ))
 
         # Extract training load from mostRecentTrainingLoadBalance
         load_balance = training.get("mostRecentTrainingLoadBalance")
@@ -182,12 +305,12 @@ async def sync_date(date_str: str):
                         anaerobic = device_data.get("monthlyLoadAnaerobic") or 0
                         total = round(aero_low + aero_high + anaerobic, 1)
                         if total > 0:
-                            await upsert(
+                            rows.append(_row(
                                 "training_load", date_str,
                                 acute_load=total,
                                 chronic_load=None,
                                 load_ratio=None,
-                            )
+                            ))
                         break  # use first/primary device only
 
         # Fallback: legacy aggregatedTrainingLoad format
@@ -195,24 +318,31 @@ async def sync_date(date_str: str):
             agg = training.get("aggregatedTrainingLoad") or {}
             acute = training.get("acuteLoad") or (agg.get("acuteLoad") if isinstance(agg, dict) else None)
             if acute is not None:
-                await upsert(
+                rows.append(_row(
                     "training_load", date_str,
                     acute_load=acute,
                     chronic_load=training.get("chronicLoad") or (agg.get("chronicLoad") if isinstance(agg, dict) else None),
                     load_ratio=training.get("loadRatio") or (agg.get("loadRatio") if isinstance(agg, dict) else None),
-                )
+                ))
+
+    # Only cache payloads that produced a row; an empty response may just
+    # mean the watch has not synced yet
+    productive = {_TABLE_ENDPOINTS[table] for table, _, _ in rows}
+    await garmin_client.store_cached(date_str, {name: payloads[name] for name in fresh & productive})
+    return rows
 
 
-async def sync_weight_history(start_date: str, end_date: str):
-    """Pull weight data from Garmin and store in weight_history table."""
-    data = garmin_client.get_weight_range(start_date, end_date)
+async def sync_weight_history(start_date: str, end_date: str) -> list[tuple[str, str, dict]]:
+    """Pull weight data from Garmin and return weight_history rows to store."""
+    rows = []
+    data = await garmin_client.get_weight_range_async(start_date, end_date)
     if not data:
-        return
+        return rows
 
     # garminconnect returns {dailyWeightSummaries: [...]}
     weights = data.get("dailyWeightSummaries", data) if isinstance(data, dict) else data
     if not isinstance(weights, list):
-        return
+        return rows
 
     for entry in weights:
         if not isinstance(entry, dict):
@@ -226,55 +356,73 @@ async def sync_weight_history(start_date: str, end_date: str):
             if isinstance(date_val, (int, float)):
                 date_val = datetime.fromtimestamp(date_val / 1000, tz=timezone.utc).strftime("%Y-%m-%d")
             if date_val and weight_g:
-                await upsert(
+                rows.append(_row(
                     "weight_history", date_val,
                     weight_grams=weight_g,
                     bmi=latest.get("bmi"),
                     body_fat=latest.get("bodyFat"),
-                )
+                ))
+
+    return rows
 
 
 async def run_sync(days: int = 7):
     """Run a full sync for the given number of days back from today."""
+    global last_completed, last_status
     logger.info("Starting sync for last %d days", days)
     start_time = datetime.now(timezone.utc)
     result = "success"
     errors = 0
 
-    garmin_client.authenticate()
+    await garmin_client.ensure_authenticated(refresh=True)
 
     today = datetime.now(timezone.utc).date()
     dates = [(today - timedelta(days=i)).isoformat() for i in range(days)]
 
     # Determine which dates need syncing per table
     # For incremental: skip dates we already have (except today, always refresh)
-    tables = [
-        "sleep", "resting_hr", "hrv", "body_battery",
-        "stress", "vo2max", "training_load", "steps", "active_calories",
-    ]
-    existing = {}
-    for table in tables:
-        existing[table] = await get_synced_dates(table)
+    existing = await get_synced_dates(dates[-1])
 
     today_str = today.isoformat()
 
-    for date_str in dates:
-        # Check if ALL tables already have this date (and it's not today)
-        if date_str != today_str:
-            all_present = all(date_str in existing[t] for t in tables)
-            if all_present:
-                continue
+    # Past dates present in every table are skipped; today is always refreshed
+    fully_synced = set.intersection(*existing.values())
+    fully_synced.discard(today_str)
+    pending = [date_str for date_str in dates if date_str not in fully_synced]
 
+    # Cached payloads outside the backfill window will never be read again
+    await garmin_client.prune_cache((today - timedelta(days=max(days, BACKFILL_DAYS))).isoformat())
+
+    # Range-capable endpoints are fetched for the whole window up front and
+    # handed to the per-date fetches below
+    prefetched = {}
+    if pending:
         try:
-            await sync_date(date_str)
+            prefetched = await garmin_client.fetch_daily_ranges(pending[-1], pending[0])
+        except Exception as e:
+            logger.warning("Range prefetch failed, falling back to per-date fetches: %s", e)
+
+    # Fetch dates concurrently; the semaphore bounds in-flight Garmin calls
+    semaphore = asyncio.Semaphore(garmin_client.FETCH_CONCURRENCY)
+
+    batcher = RowBatcher()
+
+    async def _sync_one(date_str: str) -> bool:
+        # Past dates only need the tables still missing them; today is refreshed in full
+        tables = None if date_str == today_str else {t for t in SYNC_TABLES if date_str not in existing[t]}
+        try:
+            await batcher.add(await sync_date(date_str, semaphore, tables, prefetched.get(date_str)))
         except Exception:
             logger.exception("Error syncing date %s", date_str)
-            errors += 1
+            return False
+        return True
+
+    errors += sum(not ok for ok in await asyncio.gather(*(_sync_one(d) for d in pending)))
 
     # Weight history — fetch as a range
     try:
         start_date = (today - timedelta(days=days)).isoformat()
-        await sync_weight_history(start_date, today_str)
+        await batcher.add(await sync_weight_history(start_date, today_str))
     except Exception as e:
         logger.error("Error syncing weight history: %s", e)
         errors += 1
@@ -282,29 +430,31 @@ async def run_sync(days: int = 7):
     if errors:
         result = f"completed with {errors} errors"
 
-    # Update sync status
     elapsed = (datetime.now(timezone.utc) - start_time).total_seconds()
     logger.info("Sync completed in %.1fs — %s", elapsed, result)
 
-    db = await get_db()
-    try:
+    # The last batch and the sync status commit together
+    async with acquire_writer() as db:
+        await batcher.flush(db)
         await db.execute(
             "INSERT OR REPLACE INTO sync_status (id, last_sync_time, last_sync_result, last_sync_days) VALUES (1, ?, ?, ?)",
             (start_time.isoformat(), result, days),
         )
-        await db.commit()
-    finally:
-        await db.close()
 
+    last_status = {
+        "last_sync_time": start_time.isoformat(),
+        "last_sync_result": result,
+        "last_sync_days": days,
+    }
+    last_completed = time.monotonic()
     return result
 
 
 async def scheduled_sync():
     """Background loop that syncs every SYNC_INTERVAL_HOURS."""
-    # Initial backfill of 90 days
-    logger.info("Running initial 90-day backfill...")
+    logger.info("Running initial %d-day backfill...", BACKFILL_DAYS)
     try:
-        await run_sync(days=90)
+        await run_sync(days=BACKFILL_DAYS)
     except Exception as e:
         logger.error("Initial backfill failed: %s", e)
 
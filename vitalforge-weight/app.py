@@ -1,10 +1,10 @@
+import asyncio
 import sys
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException
-from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.requests import Request
 from pydantic import BaseModel
@@ -12,9 +12,10 @@ from pydantic import BaseModel
 # Make shared module importable
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
-from shared.database import get_db, init_db
-from shared.garmin_client import authenticate, push_weight
+from shared.database import acquire_reader, acquire_writer, close_db, init_db
+from shared.garmin_client import ensure_authenticated, keepalive, push_weight
 from shared.auth import add_auth_routes
+from shared.static_files import CachedStaticFiles, make_static_url
 
 import os
 import logging
@@ -22,10 +23,111 @@ import logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
 logger = logging.getLogger(__name__)
 
-LBS_PER_KG = 2.20462
 GRAMS_PER_LB = 453.592
 GRAMS_PER_KG = 1000
 
+_INSERT_WEIGHT_SQL = (
+    "INSERT INTO weight_log (weight_lbs, weight_kg, weight_grams, timestamp, synced_to_garmin) "
+    f"VALUES (ROUND(?1 / {GRAMS_PER_LB}, 2), ROUND(?1 / {GRAMS_PER_KG}.0, 2), ?1, ?2, 0) "
+    "RETURNING id, weight_lbs, weight_kg"
+)
+
+# Seconds to wait before the first retries of a failed Garmin push; the
+# failed row is re-queued after the delay rather than blocking the pusher
+PUSH_RETRY_DELAYS = (10, 60, 300)
+
+# Failed pushes beyond the retry delays are left to the sweep, which re-queues
+# them every PUSH_SWEEP_MINUTES until PUSH_MAX_ATTEMPTS attempts have failed.
+# Only weigh-ins logged through garmin_push_queue are ever pushed, so rows
+# left unsynced by older versions are not uploaded after an upgrade.
+PUSH_SWEEP_MINUTES = float(os.getenv("GARMIN_PUSH_SWEEP_MINUTES", "15"))
+PUSH_MAX_ATTEMPTS = int(os.getenv("GARMIN_PUSH_MAX_ATTEMPTS", "8"))
+
+# weight_log ids waiting to be pushed to Garmin, or to be re-queued after a
+# retry delay. POST /api/weight only stores locally and enqueues;
+# _garmin_pusher() does the slow network round-trip.
+_push_queue: asyncio.Queue[int] = asyncio.Queue()
+_queued: set[int] = set()
+
+
+def _enqueue_push(row_id: int):
+    if row_id not in _queued:
+        _queued.add(row_id)
+        _push_queue.put_nowait(row_id)
+
+
+async def _push_one(row_id: int) -> float | None:
+    """Make one attempt to push a queued weigh-in to Garmin.
+
+    Returns the delay before the row should be retried, or None when it is
+    done with for now (pushed, gone, out of attempts, or left to the sweep).
+    """
+    async with acquire_reader() as db:
+        async with db.execute(
+            "SELECT w.weight_grams, w.timestamp, q.attempts FROM garmin_push_queue q "
+            "JOIN weight_log w ON w.id = q.weight_id WHERE q.weight_id = ? AND w.synced_to_garmin = 0",
+            (row_id,),
+        ) as cursor:
+            row = await cursor.fetchone()
+    if row is None:
+        return None  # deleted or already synced while queued
+
+    try:
+        # Retries re-login in case the failure was an expired session
+        await ensure_authenticated(refresh=row["attempts"] > 0)
+        await asyncio.to_thread(push_weight, row["weight_grams"], datetime.fromisoformat(row["timestamp"]))
+    except Exception as e:
+        attempts = row["attempts"] + 1
+        logger.error("Failed to push weight %d to Garmin (attempt %d): %s", row_id, attempts, e)
+        async with acquire_writer() as db:
+            await db.execute(
+                "UPDATE garmin_push_queue SET attempts = ?, last_error = ? WHERE weight_id = ?",
+                (attempts, str(e), row_id),
+            )
+        if attempts >= PUSH_MAX_ATTEMPTS:
+            logger.warning("Giving up on weight %d after %d attempts", row_id, attempts)
+            return None
+        return PUSH_RETRY_DELAYS[attempts - 1] if attempts <= len(PUSH_RETRY_DELAYS) else None
+
+    async with acquire_writer() as db:
+        await db.execute("UPDATE weight_log SET synced_to_garmin = 1 WHERE id = ?", (row_id,))
+        await db.execute("DELETE FROM garmin_push_queue WHERE weight_id = ?", (row_id,))
+    return None
+
+
+async def _garmin_pusher():
+    """Background loop that pushes queued weights one at a time."""
+    loop = asyncio.get_running_loop()
+    while True:
+        row_id = await _push_queue.get()
+        retry_in = None
+        try:
+            retry_in = await _push_one(row_id)
+        except Exception:
+            logger.exception("Garmin push for weight %d failed", row_id)
+        if retry_in is None:
+            _queued.discard(row_id)
+        else:
+            # Stays in _queued so the sweep doesn't queue it a second time
+            loop.call_later(retry_in, _push_queue.put_nowait, row_id)
+
+
+async def _sweep_unsynced():
+    """Queue pending pushes with attempts left, now and every PUSH_SWEEP_MINUTES."""
+    while True:
+        try:
+            async with acquire_reader() as db:
+                async with db.execute(
+                    "SELECT weight_id FROM garmin_push_queue WHERE attempts < ? ORDER BY weight_id",
+                    (PUSH_MAX_ATTEMPTS,),
+                ) as cursor:
+                    rows = await cursor.fetchall()
+            for row in rows:
+                _enqueue_push(row["weight_id"])
+        except Exception as e:
+            logger.error("Failed to queue unsynced weights: %s", e)
+        await asyncio.sleep(PUSH_SWEEP_MINUTES * 60)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -33,10 +135,22 @@ async def lifespan(app: FastAPI):
     await init_db()
     logger.info("Authenticating with Garmin Connect...")
     try:
-        authenticate()
+        await ensure_authenticated()
     except Exception as e:
         logger.warning("Garmin authentication failed (will retry on first request): %s", e)
+
+    tasks = [
+        asyncio.create_task(keepalive()),
+        asyncio.create_task(_garmin_pusher()),
+        asyncio.create_task(_sweep_unsynced()),
+    ]
     yield
+    # Let cancelled tasks unwind out of acquire_reader/acquire_writer before
+    # the connections they hold are closed
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await close_db()
 
 
 app = FastAPI(title="VitalForge Weight", lifespan=lifespan)
@@ -44,8 +158,17 @@ app = FastAPI(title="VitalForge Weight", lifespan=lifespan)
 # Auth routes and middleware
 add_auth_routes(app)
 
-app.mount("/static", StaticFiles(directory=Path(__file__).parent / "static"), name="static")
+STATIC_DIR = Path(__file__).parent / "static"
+app.mount("/static", CachedStaticFiles(directory=STATIC_DIR), name="static")
 templates = Jinja2Templates(directory=Path(__file__).parent / "templates")
+templates.env.globals["static_url"] = make_static_url(STATIC_DIR)
+
+# Page settings come from the environment, which is fixed for the process
+_INDEX_CONTEXT = {
+    "dashboard_url": os.environ.get("DASHBOARD_URL", ""),
+    "default_unit": os.environ.get("DEFAULT_UNIT", "lbs"),
+    "tz": os.environ.get("TZ", ""),
+}
 
 
 class WeightIn(BaseModel):
@@ -60,12 +183,7 @@ async def health():
 
 @app.get("/")
 async def index(request: Request):
-    return templates.TemplateResponse("index.html", {
-        "request": request,
-        "dashboard_url": os.environ.get("DASHBOARD_URL", ""),
-        "default_unit": os.environ.get("DEFAULT_UNIT", "lbs"),
-        "tz": os.environ.get("TZ", ""),
-    })
+    return templates.TemplateResponse("index.html", {"request": request, **_INDEX_CONTEXT})
 
 
 @app.post("/api/weight")
@@ -74,61 +192,38 @@ async def post_weight(data: WeightIn):
     if unit not in ("lbs", "kg"):
         raise HTTPException(status_code=400, detail="unit must be 'lbs' or 'kg'")
 
-    if unit == "lbs":
-        weight_lbs = data.weight
-        weight_kg = data.weight / LBS_PER_KG
-    else:
-        weight_kg = data.weight
-        weight_lbs = data.weight * LBS_PER_KG
+    # Grams are the canonical value; SQLite derives the rounded lbs/kg columns
+    weight_grams = round(data.weight * (GRAMS_PER_LB if unit == "lbs" else GRAMS_PER_KG))
+    timestamp = datetime.now(timezone.utc).isoformat()
 
-    weight_grams = round(weight_kg * GRAMS_PER_KG)
-    now = datetime.now(timezone.utc)
-    timestamp = now.isoformat()
+    # Save to local database; the Garmin push happens in the background
+    async with acquire_writer() as db:
+        async with db.execute(_INSERT_WEIGHT_SQL, (weight_grams, timestamp)) as cursor:
+            row = await cursor.fetchone()
+        await db.execute("INSERT INTO garmin_push_queue (weight_id) VALUES (?)", (row["id"],))
+    _enqueue_push(row["id"])
 
-    # Push to Garmin Connect
-    garmin_error = None
-    try:
-        authenticate()
-        push_weight(weight_grams, now)
-        synced = 1
-    except Exception as e:
-        logger.error("Failed to push weight to Garmin: %s", e)
-        garmin_error = str(e)
-        synced = 0
-
-    # Save to local database
-    db = await get_db()
-    try:
-        await db.execute(
-            "INSERT INTO weight_log (weight_lbs, weight_kg, weight_grams, timestamp, synced_to_garmin) VALUES (?, ?, ?, ?, ?)",
-            (round(weight_lbs, 2), round(weight_kg, 2), weight_grams, timestamp, synced),
-        )
-        await db.commit()
-    finally:
-        await db.close()
-
-    result = {
+    return {
         "success": True,
-        "weight_lbs": round(weight_lbs, 2),
-        "weight_kg": round(weight_kg, 2),
+        # RETURNING yields the raw stored value, which SQLite keeps as an
+        # integer when whole; float() matches what SELECTs return
+        "weight_lbs": float(row["weight_lbs"]),
+        "weight_kg": float(row["weight_kg"]),
         "timestamp": timestamp,
-        "synced_to_garmin": bool(synced),
+        "synced_to_garmin": False,
+        "garmin_pending": True,
     }
-    if garmin_error:
-        result["garmin_error"] = garmin_error
-    return result
 
 
 @app.get("/api/weight/recent")
 async def get_recent_weights():
-    db = await get_db()
-    try:
-        cursor = await db.execute(
-            "SELECT id, weight_lbs, weight_kg, timestamp, synced_to_garmin FROM weight_log ORDER BY timestamp DESC LIMIT 10"
-        )
-        rows = await cursor.fetchall()
-    finally:
-        await db.close()
+    async with acquire_reader() as db:
+        async with db.execute(
+            "SELECT w.id, w.weight_lbs, w.weight_kg, w.timestamp, w.synced_to_garmin, q.attempts, q.last_error "
+            "FROM weight_log w LEFT JOIN garmin_push_queue q ON q.weight_id = w.id "
+            "ORDER BY w.timestamp DESC LIMIT 10"
+        ) as cursor:
+            rows = await cursor.fetchall()
 
     return [
         {
@@ -137,6 +232,8 @@ async def get_recent_weights():
             "weight_kg": row["weight_kg"],
             "timestamp": row["timestamp"],
             "synced_to_garmin": bool(row["synced_to_garmin"]),
+            "garmin_pending": row["attempts"] is not None and row["attempts"] < PUSH_MAX_ATTEMPTS,
+            "garmin_error": row["last_error"],
         }
         for row in rows
     ]
@@ -145,14 +242,15 @@ async def get_recent_weights():
 @app.get("/api/weight/trend")
 async def get_weight_trend():
     """Return last 30 days of weights for the trend chart."""
-    db = await get_db()
-    try:
-        cursor = await db.execute(
-            "SELECT weight_lbs, weight_kg, timestamp FROM weight_log WHERE timestamp >= datetime('now', '-30 days') ORDER BY timestamp ASC"
-        )
-        rows = await cursor.fetchall()
-    finally:
-        await db.close()
+    # Bound parameter in the stored isoformat, so the timestamp index can be
+    # range-scanned instead of calling datetime() per row
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=30)).isoformat()
+    async with acquire_reader() as db:
+        async with db.execute(
+            "SELECT weight_lbs, weight_kg, timestamp FROM weight_log WHERE timestamp >= ? ORDER BY timestamp ASC",
+            (cutoff,),
+        ) as cursor:
+            rows = await cursor.fetchall()
 
     return [
         {"weight_lbs": row["weight_lbs"], "weight_kg": row["weight_kg"], "timestamp": row["timestamp"]}
@@ -162,13 +260,9 @@ async def get_weight_trend():
 
 @app.delete("/api/weight/{weight_id}")
 async def delete_weight(weight_id: int):
-    db = await get_db()
-    try:
+    async with acquire_writer() as db:
         cursor = await db.execute("DELETE FROM weight_log WHERE id = ?", (weight_id,))
-        await db.commit()
-        if cursor.rowcount == 0:
-            raise HTTPException(status_code=404, detail="Weight entry not found")
-    finally:
-        await db.close()
+    if cursor.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Weight entry not found")
 
     return {"success": True, "deleted_id": weight_id}